@@ -1,10 +1,10 @@
 # -*- coding: utf-8 -*-
 
-from ec2gazua import gazua
+from ec2gazua import cli
 
 
 def main():
-    gazua.run()
+    cli.main()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+
+from itertools import chain
+
+from os.path import dirname
+from os.path import exists
+
+from ec2gazua import snapshot
+from ec2gazua.ec2 import EC2InstanceLoader
+from ec2gazua.logger import log
+from ec2gazua.profiler import span
+from ec2gazua.snapshot import SnapshotLoader
+from ec2gazua.sshconfig import SSHConfig
+from ec2gazua.utils import runtime_path
+
+REFRESH_INTERVAL = 300
+CONNECT_TIMEOUT = 1
+START_TIMEOUT = 5
+# a just started agent answers after its first load of every account
+LOAD_TIMEOUT = 300
+
+
+def socket_path():
+    return runtime_path('agent.sock')
+
+
+class Agent(object):
+    # owns a loader, refreshes it periodically and serves the inventory in
+    # the snapshot format to every terminal over a user-only unix socket
+
+    def __init__(self, path=None, refresh_interval=REFRESH_INTERVAL,
+                 create_loader=EC2InstanceLoader, ssh_config=None):
+        self.path = path or socket_path()
+        self.ssh_config = ssh_config or SSHConfig()
+        self.refresh_interval = refresh_interval
+        self.create_loader = create_loader
+        self.server = None
+        # the encoded inventory, the same bytes are sent to every client
+        self.payload = None
+        self.count = 0
+        self.refreshed = None
+        self.ready = threading.Event()
+        self._refreshing = threading.Lock()
+        self._stopped = threading.Event()
+
+    def refresh(self):
+        # a new loader reads the config again, credentials come from the
+        # credential cache
+        if not self._refreshing.acquire(blocking=False):
+            return False
+
+        try:
+            with span('agent.refresh'):
+                loader = self.create_loader()
+                manager = loader.load_all()
+                fp = io.StringIO()
+                snapshot.dump(fp, loader)
+            self.payload = fp.getvalue().encode('utf-8')
+            self.count = sum(len(i) for i in loader.instances.values())
+            self.refreshed = time.time()
+            self.ssh_config.update(manager)
+            log.info('Agent refreshed %d instances', self.count)
+        except Exception:
+            # the last inventory is served until a refresh succeeds
+            log.exception('Agent refresh failed')
+        finally:
+            self._refreshing.release()
+            self.ready.set()
+        return True
+
+    def status(self):
+        return {'pid': os.getpid(), 'instances': self.count,
+                'refreshed': self.refreshed}
+
+    def serve(self):
+        self.server = AgentServer(self.path, self)
+        threading.Thread(target=self._refresh_loop, daemon=True).start()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if exists(self.path):
+                os.unlink(self.path)
+
+    def _refresh_loop(self):
+        while not self._stopped.is_set():
+            self.refresh()
+            self._stopped.wait(self.refresh_interval)
+
+    def stop(self):
+        self._stopped.set()
+        # shutdown waits for serve_forever, which runs in another thread
+        threading.Thread(target=self.server.shutdown).start()
+
+
+class AgentServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, agent):
+        self.agent = agent
+
+        folder = dirname(path)
+        if not exists(folder):
+            os.makedirs(folder, 0o700)
+        if is_running(path):
+            raise OSError('Agent is already running [%s]' % path)
+        if exists(path):
+            # left over by an agent that did not stop cleanly
+            os.unlink(path)
+
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path, AgentHandler)
+        finally:
+            os.umask(umask)
+
+    def handle_error(self, request, client_address):
+        log.exception('Agent request failed')
+
+
+class AgentHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        agent = self.server.agent
+        line = self.rfile.readline()
+        if not line:
+            # is_running only connects
+            return
+
+        try:
+            request = json.loads(line.decode('utf-8'))
+            command = request['command']
+        except (ValueError, KeyError, TypeError):
+            return self._reply({'error': 'Invalid request'})
+
+        if command == 'inventory':
+            agent.ready.wait()
+            if agent.payload is None:
+                return self._reply({'error': 'Inventory loading failed'})
+            self.wfile.write(agent.payload)
+        elif command == 'refresh':
+            threading.Thread(target=agent.refresh, daemon=True).start()
+            self._reply({'ok': True})
+        elif command == 'status':
+            self._reply(agent.status())
+        elif command == 'stop':
+            self._reply({'ok': True})
+            agent.stop()
+        else:
+            self._reply({'error': "Unknown command '%s'" % command})
+
+    def _reply(self, data):
+        self.wfile.write(json.dumps(data).encode('utf-8') + b'\n')
+
+
+def connect(path=None, timeout=CONNECT_TIMEOUT):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path or socket_path())
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def is_running(path=None):
+    try:
+        connect(path).close()
+        return True
+    except OSError:
+        return False
+
+
+def request(command, path=None, timeout=LOAD_TIMEOUT):
+    # returns the response as a file of lines
+    sock = connect(path)
+    sock.settimeout(timeout)
+    with sock:
+        sock.sendall(json.dumps({'command': command}).encode('utf-8') + b'\n')
+        return sock.makefile('r', encoding='utf-8')
+
+
+def call(command, path=None):
+    with request(command, path, timeout=CONNECT_TIMEOUT) as fp:
+        return json.loads(fp.readline() or 'null')
+
+
+def start(path=None, timeout=START_TIMEOUT):
+    if is_running(path):
+        return False
+
+    subprocess.Popen([sys.executable, '-m', 'ec2gazua.agent'],
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL, start_new_session=True)
+
+    deadline = time.time() + timeout
+    while not is_running(path):
+        if time.time() > deadline:
+            raise OSError('Agent did not start in %ds' % timeout)
+        time.sleep(0.05)
+    return True
+
+
+class AgentLoader(SnapshotLoader):
+    # serves the inventory of a running agent like a snapshot. the polls of
+    # the ui notice a refresh of the agent, which is then read again
+    refreshable = True
+
+    def __init__(self, path=None, lazy=False):
+        # refreshed time of the agent at the last read, and the accounts of
+        # that read not fetched yet
+        self.refreshed = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        super(AgentLoader, self).__init__(path or socket_path(), lazy=lazy)
+
+    def _read(self):
+        # stamped before reading, so a refresh while reading is read again
+        self.refreshed = call('status', self.path).get('refreshed')
+        super(AgentLoader, self)._read()
+
+    def _update(self):
+        with self._lock:
+            if call('status', self.path).get('refreshed') == self.refreshed:
+                return
+            latest = AgentLoader(self.path)
+            for aws_name, config in latest.config.items():
+                self.config[aws_name] = config
+            self.refreshed = latest.refreshed
+            self._pending = latest.instances
+
+    def fetch(self, aws_name):
+        self._update()
+        with self._lock:
+            if aws_name in self._pending:
+                self.instances[aws_name] = self._pending.pop(aws_name)
+        self.fetched_at[aws_name] = time.time()
+
+    def poll_states(self, aws_name):
+        # None once the agent refreshed, the states do not change otherwise
+        with span('loader.poll_states', aws_name=aws_name):
+            self._update()
+            with self._lock:
+                if aws_name in self._pending:
+                    return None
+            instances = self.instances.get(aws_name, [])
+            return instances, {i.id: i.state for i in instances}, {}
+
+    def _entries(self):
+        with span('agent.request'):
+            fp = request('inventory', self.path)
+
+        with fp:
+            line = fp.readline()
+            header = json.loads(line or 'null')
+            if isinstance(header, dict) and 'error' in header:
+                raise ValueError('Agent: %s' % header['error'])
+            for entry in snapshot.read(chain([line], fp), 'agent'):
+                yield entry
+
+
+def create_loader(lazy=False, start_agent=False):
+    # the running agent (started first if asked), loading in process when
+    # it is not there
+    try:
+        if start_agent:
+            start()
+        return AgentLoader(lazy=lazy)
+    except (OSError, ValueError) as e:
+        if start_agent:
+            log.warning('Agent unavailable, loading in process: %s', e)
+        return EC2InstanceLoader(lazy=lazy)
+
+
+if __name__ == '__main__':
+    Agent().serve()
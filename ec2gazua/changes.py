@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import re
+
+from os.path import exists
+
+from ec2gazua import utils
+from ec2gazua.ec2 import ALL
+from ec2gazua.ec2 import EC2Instance
+from ec2gazua.logger import log
+from ec2gazua.profiler import span
+from ec2gazua.query import Index
+from ec2gazua.query import compile_query
+from ec2gazua.query import field_values
+
+NEW = 'new'
+CHANGED = 'changed'
+GONE = 'gone'
+
+_UNSAFE = re.compile(r'[^\w.-]')
+
+DEFAULT_GROUP = EC2Instance.DEFAULT_GROUP
+
+
+def fingerprint(instance):
+    # a stable 64 bit hash of the fields shown in the list
+    value = '\0'.join(v or '' for v in (
+        instance.name, instance.state, instance.type, instance.private_ip,
+        instance.public_ip, instance.aws_key_name))
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'),
+                                          digest_size=8).digest(), 'big')
+
+
+class GoneInstance(object):
+    # a row for an instance of the last inventory which is not there anymore,
+    # with the tags of the grouping dimensions of its account
+    __slots__ = ('id', 'name', 'tags')
+
+    type = state = private_ip = public_ip = key_name = aws_key_name = None
+    version = 0
+    is_running = False
+    is_connectable = False
+
+    def __init__(self, instance_id, name, tags):
+        self.id = instance_id
+        self.name = name
+        self.tags = tags
+
+    def pivot(self, tag_keys):
+        for key in tag_keys:
+            if key in self.tags:
+                return self.tags[key]
+        return DEFAULT_GROUP
+
+
+class Changes(object):
+    # per account fingerprints, id: [hash, name, tags], of the inventory
+    # last looked at. loads are compared with them, the ones of this run
+    # are saved on exit. only the tags of the grouping dimensions are kept,
+    # not inventories
+    FINGERPRINT_FOLDER = utils.state_path('fingerprints')
+
+    def __init__(self, folder=None):
+        self.folder = folder or self.FINGERPRINT_FOLDER
+        self.baselines = {}
+        self.current = {}
+        # change per instance id and gone instances, per aws name
+        self.changes = {}
+        self.gone = {}
+        # configured grouping dimension per aws name
+        self.dimensions = {}
+
+    def _path(self, aws_name):
+        return '%s/%s.json' % (self.folder, _UNSAFE.sub('_', aws_name))
+
+    def _read(self, aws_name):
+        path = self._path(aws_name)
+        if not exists(path):
+            return None
+        try:
+            return json.loads(utils.read(path))
+        except (IOError, OSError, ValueError):
+            log.exception('Failed to read fingerprints [%s]', path)
+            return None
+
+    def update(self, aws_name, instances, dimensions):
+        # instances are every instance of the account, before filtering
+        keys = []
+        for dimension in dimensions:
+            keys += [k for k in dimension if k not in keys]
+        self.dimensions[aws_name] = dimensions[0]
+        with span('changes.update', aws=aws_name, count=len(instances)):
+            current = {i.id: [fingerprint(i), i.name,
+                              {k: i.tags[k] for k in keys if k in i.tags}]
+                       for i in instances}
+            self.current[aws_name] = current
+
+            if aws_name not in self.baselines:
+                # nothing changed on the first load of an account
+                baseline = self._read(aws_name)
+                self.baselines[aws_name] = current if baseline is None \
+                    else baseline
+            self._diff(aws_name)
+
+    def _diff(self, aws_name):
+        baseline = self.baselines[aws_name]
+        current = self.current[aws_name]
+
+        changes = {}
+        for instance_id, (value, _, _) in current.items():
+            last = baseline.get(instance_id)
+            if last is None:
+                changes[instance_id] = NEW
+            elif last[0] != value:
+                changes[instance_id] = CHANGED
+        self.changes[aws_name] = changes
+        # fingerprints saved before the tags were kept have a group there
+        self.gone[aws_name] = [
+            GoneInstance(instance_id, name,
+                         tags if isinstance(tags, dict) else {})
+            for instance_id, (_, name, tags) in baseline.items()
+            if instance_id not in current]
+
+    def get(self, instance):
+        if isinstance(instance, GoneInstance):
+            return GONE
+        changes = self.changes.get(instance.config.get('name'))
+        return changes.get(instance.id) if changes else None
+
+    def get_gone(self, aws_name, group, keyword=None, dimension=None):
+        # gone instances are grouped like the list, by the dimension chosen
+        # in the ui or else the configured one of each account
+        aws_names = list(self.gone) if aws_name == ALL else [aws_name]
+        gone = []
+        for name in aws_names:
+            tag_keys = dimension or self.dimensions.get(name, ())
+            gone += [i for i in self.gone.get(name, ())
+                     if group == ALL or i.pivot(tag_keys) == group]
+        if not gone or not keyword or not keyword.strip():
+            return gone
+        return compile_query(keyword).filter(
+            gone, lambda field: Index(gone, field_values(field)))
+
+    def counts(self):
+        counts = {NEW: 0, CHANGED: 0, GONE: 0}
+        for changes in self.changes.values():
+            for change in changes.values():
+                counts[change] += 1
+        counts[GONE] = sum(len(gone) for gone in self.gone.values())
+        return counts
+
+    def mark_seen(self):
+        for aws_name, current in self.current.items():
+            self.baselines[aws_name] = current
+            self._diff(aws_name)
+
+    def save(self):
+        for aws_name, current in self.current.items():
+            try:
+                utils.write_private(self._path(aws_name),
+                                    json.dumps(current,
+                                               separators=(',', ':')))
+            except (IOError, OSError):
+                log.exception('Failed to save fingerprints [%s]', aws_name)
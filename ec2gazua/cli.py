@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import logging
+import os
+import sys
+
+import yaml
+
+from ec2gazua import agent
+from ec2gazua import ec2
+from ec2gazua import gazua
+from ec2gazua import snapshot
+from ec2gazua import tmux
+from ec2gazua.config import Config
+from ec2gazua.history import History
+from ec2gazua.sshconfig import SSHConfig
+from ec2gazua.logger import ConsoleLogger
+from ec2gazua.logger import console
+from ec2gazua.logger import log
+from ec2gazua.logger import set_level
+from ec2gazua.profiler import profiler
+from ec2gazua.scheduler import scheduler
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        prog='ec2-gz', description='Easy accessing EC2 SSH through tmux')
+    parser.add_argument(
+        '--lazy', action='store_true',
+        help='load only the last used aws account at start and the others '
+             'when they are focused')
+    parser.add_argument(
+        '--offline', metavar='FILE',
+        help='browse instances from a snapshot file instead of aws')
+    parser.add_argument(
+        '--agent', action='store_true',
+        help='start the background agent if it is not running and load '
+             'instances from it (a running agent is always used)')
+    parser.add_argument(
+        '--log-level', metavar='LEVEL',
+        help='file log level (default: $GZ_LOG_LEVEL, log-level of the '
+             'config or WARNING)')
+    parser.add_argument(
+        '--profile', action='store_true',
+        help='print a timing breakdown on exit')
+    parser.add_argument(
+        '--profile-trace', metavar='FILE',
+        help='write a JSON trace (chrome://tracing format) on exit')
+
+    commands = parser.add_subparsers(dest='command')
+
+    snapshot_parser = commands.add_parser(
+        'snapshot', help='save or load an offline snapshot of instances')
+    snapshot_commands = snapshot_parser.add_subparsers(
+        dest='snapshot_command')
+    snapshot_commands.required = True
+    snapshot_commands.add_parser(
+        'save', help='load instances from aws and save them').add_argument(
+        'file')
+    snapshot_commands.add_parser(
+        'load', help='browse instances from a snapshot').add_argument('file')
+
+    agent_parser = commands.add_parser(
+        'agent', help='manage the background agent sharing instances '
+                      'between terminals')
+    agent_parser.add_argument(
+        'agent_command', choices=('run', 'start', 'stop', 'status',
+                                  'refresh'))
+
+    commands.add_parser(
+        'list', help='print instances matching a query').add_argument(
+        'query', nargs='*')
+    commands.add_parser(
+        'connect', help='connect to instances matching a query').add_argument(
+        'query', nargs='+')
+    commands.add_parser(
+        'recent', help='print the recent sessions, or connect to the '
+                       'instances of one again').add_argument(
+        'session', nargs='?', type=int)
+    commands.add_parser(
+        'ssh-config', help='write a Host per connectable instance to '
+                           '%s, kept up to date from then on' %
+                           SSHConfig.SSH_CONFIG_FILE)
+
+    return parser
+
+
+def run_snapshot(args):
+    if args.snapshot_command == 'save':
+        loader = ec2.EC2InstanceLoader()
+        loader.load_all()
+        snapshot.save(args.file, loader)
+        console('Snapshot saved [%s] %d instances' % (
+            args.file, sum(len(i) for i in loader.instances.values())))
+    else:
+        gazua.run(lazy=args.lazy,
+                  loader=snapshot.SnapshotLoader(args.file, lazy=args.lazy))
+
+
+def run_agent(args):
+    if args.agent_command == 'run':
+        agent.Agent().serve()
+    elif args.agent_command == 'start':
+        console('Agent started' if agent.start() else
+                'Agent is already running')
+    elif not agent.is_running():
+        console('Agent is not running')
+        sys.exit(1)
+    else:
+        console(agent.call(args.agent_command))
+
+
+def create_loader(args):
+    if args.offline:
+        return snapshot.SnapshotLoader(args.offline, lazy=args.lazy)
+    return agent.create_loader(lazy=args.lazy, start_agent=args.agent)
+
+
+def find_instances(args):
+    # list and connect print only their results
+    set_level(logging.getLogger(ConsoleLogger.NAME), logging.WARNING)
+    manager = create_loader(args).load_all()
+    try:
+        return list(manager.find(' '.join(args.query)))
+    except ValueError as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(2)
+
+
+def run_list(args):
+    for aws_name, instance in find_instances(args):
+        sys.stdout.write('\t'.join([
+            aws_name, instance.group, instance.name, instance.id or '-',
+            instance.private_ip or '-', instance.public_ip or '-',
+            instance.type or '-', instance.state or '-']) + '\n')
+
+
+def run_connect(args):
+    instances = [i for _, i in find_instances(args) if i.is_connectable]
+    connect(instances)
+
+
+def connect(instances):
+    if not instances:
+        sys.stderr.write('There is no connectable instance\n')
+        sys.exit(1)
+    History().record(instances)
+    tmux.run([tmux.create_ssh_param(i) for i in instances])
+
+
+def run_recent(args):
+    history = History()
+    sessions = history.sessions()
+    if args.session is None:
+        for label in history.labels(sessions):
+            sys.stdout.write(label + '\n')
+        return
+
+    if not 0 < args.session <= len(sessions):
+        sys.stderr.write('There is no session %d\n' % args.session)
+        sys.exit(2)
+
+    # the instances are looked up by id, so their current ips are used
+    set_level(logging.getLogger(ConsoleLogger.NAME), logging.WARNING)
+    manager = create_loader(args).load_all()
+    _, hosts = sessions[args.session - 1]
+    connect([i for i in manager.get_by_ids([h[2] for h in hosts])
+             if i.is_connectable])
+
+
+def run_ssh_config(args):
+    set_level(logging.getLogger(ConsoleLogger.NAME), logging.WARNING)
+    manager = create_loader(args).load_all()
+    ssh_config = SSHConfig()
+    if ssh_config.write(manager):
+        sys.stdout.write('SSH config written [%s]\n' % ssh_config.path)
+    else:
+        sys.stdout.write('SSH config is up to date [%s]\n' % ssh_config.path)
+    sys.stdout.write("Include it from ~/.ssh/config with "
+                     "'Include config.d/ec2-gz'\n")
+
+
+def apply_log_level(args):
+    # --log-level, then $GZ_LOG_LEVEL, then the log-level of the config
+    if args.log_level:
+        set_level(log, args.log_level)
+        return
+    if os.environ.get('GZ_LOG_LEVEL'):
+        return
+
+    try:
+        level = Config().settings.get('log-level')
+    except (IOError, ValueError, yaml.YAMLError):
+        # reported by the loader when the config is needed
+        return
+    if level:
+        set_level(log, level)
+
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+
+    apply_log_level(args)
+
+    if args.profile or args.profile_trace:
+        profiler.enable()
+
+    try:
+        if args.command == 'snapshot':
+            run_snapshot(args)
+        elif args.command == 'agent':
+            run_agent(args)
+        elif args.command == 'list':
+            run_list(args)
+        elif args.command == 'connect':
+            run_connect(args)
+        elif args.command == 'recent':
+            run_recent(args)
+        elif args.command == 'ssh-config':
+            run_ssh_config(args)
+        else:
+            # an offline snapshot may be outdated
+            gazua.run(lazy=args.lazy, loader=create_loader(args),
+                      ssh_config=None if args.offline else SSHConfig())
+    finally:
+        if args.profile:
+            sys.stderr.write(profiler.report() + '\n')
+            if scheduler.metrics:
+                sys.stderr.write('\n' + scheduler.report() + '\n')
+        if args.profile_trace:
+            profiler.write_trace(args.profile_trace)
@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 
+import os
 import yaml
 
 from os import path
 
+from ec2gazua.profiler import span
 from ec2gazua.utils import read
 
 
@@ -12,7 +14,13 @@ class Config(object):
     FILENAME = '.ec2-gz'
     CONFIG_FILE = CONFIG_PATH + '/' + FILENAME
 
+    # changing these keys requires instances to be requested again
+    REFETCH_KEYS = ('credential', 'provider', 'path')
+
     _items = {}
+    _mtime = None
+    # a document without a name holds the settings of ec2-gz itself
+    settings = {}
 
     def __init__(self):
         self._valid_config_file()
@@ -27,17 +35,49 @@ class Config(object):
                 ".ec2-gz must be a file. not directory: %s" % self.CONFIG_FILE)
 
     def _load(self):
-        content = self._read()
+        self._mtime = self._stat()
+
+        with span('config.load'):
+            content = self._read()
 
-        configs = {}
+            configs = {}
+            settings = {}
 
-        for data in yaml.safe_load_all(content):
-            if data['name'] in configs:
-                raise ValueError(
-                    '%s is duplicated name in config' % data['name'])
-            configs[data['name']] = data
+            for data in yaml.safe_load_all(content):
+                if 'name' not in data:
+                    settings.update(data)
+                    continue
+                if data['name'] in configs:
+                    raise ValueError(
+                        '%s is duplicated name in config' % data['name'])
+                configs[data['name']] = data
 
         self._items = configs
+        self.settings = settings
+
+    def is_modified(self):
+        return self._stat() != self._mtime
+
+    def reload(self):
+        # returns aws names as (refetch, rederive, removed). rederive accounts
+        # only changed overrides, which apply to already loaded instances.
+        old = self._items
+        self._load()
+        new = self._items
+
+        removed = set(old) - set(new)
+        refetch = set()
+        rederive = set()
+
+        for name, item in new.items():
+            if name not in old or any(
+                    old[name].get(k) != item.get(k)
+                    for k in self.REFETCH_KEYS):
+                refetch.add(name)
+            elif old[name] != item:
+                rederive.add(name)
+
+        return refetch, rederive, removed
 
     def items(self):
         return self._items.items()
@@ -45,5 +85,14 @@ class Config(object):
     def _read(self):
         return read(self.CONFIG_FILE)
 
+    def _stat(self):
+        try:
+            return os.stat(self.CONFIG_FILE).st_mtime
+        except OSError:
+            return None
+
+    def __contains__(self, aws_name):
+        return aws_name in self._items
+
     def __getitem__(self, aws_name):
         return self._items[aws_name]
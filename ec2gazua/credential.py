@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+import json
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha1
+
+import boto3
+
+from ec2gazua import utils
+from ec2gazua.logger import log
+
+
+class CredentialCache(object):
+    CACHE_FILE = utils.cache_path('credentials.json')
+
+    # cached credentials expiring within this many seconds are not used
+    EXPIRY_MARGIN = 300
+
+    def __init__(self, path=None):
+        self.path = path or self.CACHE_FILE
+        self._lock = threading.Lock()
+        self._items = None
+
+    def _load(self):
+        if self._items is None:
+            try:
+                self._items = json.loads(utils.read(self.path))
+            except (IOError, ValueError):
+                self._items = {}
+        return self._items
+
+    def get(self, key):
+        with self._lock:
+            item = self._load().get(key)
+
+        if item and item['Expiration'] - self.EXPIRY_MARGIN > time.time():
+            return item
+        return None
+
+    def set(self, key, credentials):
+        with self._lock:
+            items = self._load()
+            now = time.time()
+            for expired in [k for k, v in items.items()
+                            if v['Expiration'] <= now]:
+                del items[expired]
+
+            items[key] = credentials
+            utils.write_private(self.path, json.dumps(items))
+
+
+class CredentialResolver(object):
+    SESSION_NAME = 'ec2-gz'
+    DURATION_SECONDS = 3600
+    MAX_WORKERS = 8
+
+    def __init__(self, config, cache=None):
+        self.config = config
+        self.cache = cache if cache is not None else CredentialCache()
+        # key -> (session, expiration or None for long-lived keys, the
+        # credential it was built from)
+        self._sessions = {}
+        self._prompt_lock = threading.Lock()
+        # MFA codes are only asked while the terminal is free, the ui turns
+        # this off before its main loop starts
+        self.interactive = sys.stdin is not None and sys.stdin.isatty()
+
+    def resolve_all(self, aws_names):
+        aws_names = list(aws_names)
+        if not aws_names:
+            return
+
+        workers = min(self.MAX_WORKERS, len(aws_names))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(self.session, aws_names))
+
+    def session(self, aws_name):
+        credential = self.config[aws_name]['credential']
+        key = self._cache_key(aws_name, credential)
+
+        session, expiration, built = self._sessions.get(key,
+                                                        (None, None, None))
+        # an edited credential (the key is the same for a new secret) is
+        # built again, sts credentials are renewed before they expire
+        if session is None or built != credential or \
+                expiration is not None and \
+                expiration - CredentialCache.EXPIRY_MARGIN <= time.time():
+            session, expiration = self._create_session(key, credential)
+            self._sessions[key] = session, expiration, dict(credential)
+        return session
+
+    def _cache_key(self, aws_name, credential):
+        # never includes the secret key, it names the entries of the disk
+        # cache
+        identity = [aws_name] + [
+            credential.get(k) for k in
+            ('aws_access_key_id', 'profile', 'role_arn', 'mfa_serial',
+             'region')]
+        return sha1(json.dumps(identity).encode('utf-8')).hexdigest()
+
+    def _create_session(self, key, credential):
+        region = credential.get('region')
+        session = self._base_session(credential, region)
+
+        if 'role_arn' not in credential and 'mfa_serial' not in credential:
+            return session, None
+
+        cached = self.cache.get(key)
+        if cached is None:
+            cached = self._request_credentials(session, credential)
+            self.cache.set(key, cached)
+
+        return boto3.Session(
+            aws_access_key_id=cached['AccessKeyId'],
+            aws_secret_access_key=cached['SecretAccessKey'],
+            aws_session_token=cached['SessionToken'],
+            region_name=region), cached['Expiration']
+
+    def _base_session(self, credential, region):
+        if 'aws_access_key_id' in credential:
+            return boto3.Session(
+                aws_access_key_id=credential['aws_access_key_id'],
+                aws_secret_access_key=credential['aws_secret_access_key'],
+                region_name=region)
+
+        return boto3.Session(profile_name=credential.get('profile'),
+                             region_name=region)
+
+    def _request_credentials(self, session, credential):
+        sts = session.client('sts')
+        params = {
+            'DurationSeconds': credential.get('duration_seconds',
+                                              self.DURATION_SECONDS)
+        }
+
+        if 'mfa_serial' in credential:
+            params['SerialNumber'] = credential['mfa_serial']
+            params['TokenCode'] = self._prompt_token(credential['mfa_serial'])
+
+        if 'role_arn' in credential:
+            log.info('Assume role [%s]', credential['role_arn'])
+            response = sts.assume_role(RoleArn=credential['role_arn'],
+                                       RoleSessionName=self.SESSION_NAME,
+                                       **params)
+        else:
+            response = sts.get_session_token(**params)
+
+        credentials = response['Credentials']
+        return {
+            'AccessKeyId': credentials['AccessKeyId'],
+            'SecretAccessKey': credentials['SecretAccessKey'],
+            'SessionToken': credentials['SessionToken'],
+            'Expiration': credentials['Expiration'].timestamp(),
+        }
+
+    def _prompt_token(self, mfa_serial):
+        if not self.interactive:
+            raise IOError('MFA code for %s can not be asked here, restart '
+                          'ec2-gz in a terminal to enter it' % mfa_serial)
+        with self._prompt_lock:
+            return input('MFA code for %s: ' % mfa_serial).strip()
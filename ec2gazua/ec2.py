@@ -1,126 +1,608 @@
 # -*- coding: utf-8 -*-
 
-import boto3
+import logging
+import sys
+import time
 
 from collections import OrderedDict
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 from os.path import expanduser
 from os.path import isfile
 
 from ec2gazua.config import Config
+from ec2gazua.credential import CredentialResolver
 from ec2gazua.logger import console
 from ec2gazua.logger import log
+from ec2gazua.profiler import span
+from ec2gazua.provider import FileProvider
+from ec2gazua.provider import Provider
+from ec2gazua.query import Index
+from ec2gazua.query import Query
+from ec2gazua.query import compile_query
+from ec2gazua.query import field_values
+from ec2gazua.scheduler import CLIENT_CONFIG
+from ec2gazua.scheduler import scheduler
+from ec2gazua.sort import DEFAULT_ORDER
+from ec2gazua.sort import SORT_KEYS
+from ec2gazua.sort import natural_key
+from ec2gazua.sort import parse_order
+from ec2gazua.sort import sort_instances
+from ec2gazua.utils import paused_gc
+
+# pseudo aws name and group merging every loaded account
+ALL = 'ALL'
 
 
 class EC2InstanceManager(object):
-    instances = {}
+    RESULTS_SIZE = 64
+
+    def __init__(self):
+        # groups of the active grouping dimension per aws name
+        self.instances = {}
+        # every built grouping per aws name and dimension, a dimension is a
+        # tuple of tag keys where the first tag found is used
+        self.pivots = {}
+        self.accounts = {}
+        self.dimensions = {}
+        self.dimension = None
+        self.tag_keys = {}
+        # sort order per aws name from the config, and the one chosen in the
+        # UI which overrides them
+        self.orders = {}
+        self.order = None
+        # groups over every account, built on first use after a sort or
+        # regroup
+        self.merged = None
+        # query indexes per field over every account, and the last query
+        # results per aws name and group
+        self.indexes = {}
+        self.results = OrderedDict()
+
+    def set_account(self, aws_name, instances, dimensions,
+                    order=DEFAULT_ORDER):
+        # groups are built by sort()
+        self.remove_account(aws_name)
+        self.accounts[aws_name] = instances
+        self.dimensions[aws_name] = dimensions
+        self.orders[aws_name] = order
+        self.pivots[aws_name] = {}
+        self.instances[aws_name] = OrderedDict()
+
+    def _build_pivot(self, aws_name, dimension):
+        # the account is already sorted, so are the groups built from it
+        # same as EC2Instance.pivot, inlined as it runs for every instance
+        groups = defaultdict(list)
+        for instance in self.accounts[aws_name]:
+            tags = instance.tags
+            for key in dimension:
+                if key in tags:
+                    groups[tags[key]].append(instance)
+                    break
+            else:
+                groups[EC2Instance.DEFAULT_GROUP].append(instance)
+
+        self.pivots[aws_name][dimension] = OrderedDict(
+            (group, groups[group]) for group in sorted(groups,
+                                                       key=natural_key))
+        return self.pivots[aws_name][dimension]
+
+    def _get_pivot(self, aws_name, dimension):
+        # prebuilt dimensions are swapped in, others are built once
+        pivots = self.pivots[aws_name]
+        if dimension not in pivots:
+            return self._build_pivot(aws_name, dimension)
+        return pivots[dimension]
+
+    def remove_account(self, aws_name):
+        for items in (self.instances, self.pivots, self.accounts,
+                      self.dimensions, self.tag_keys, self.orders):
+            items.pop(aws_name, None)
+        self.indexes = {}
+        self.results.clear()
+
+    def get_instances(self, aws_name, group):
+        if aws_name == ALL:
+            return self._get_merged().get(group, [])
+        return self.instances.get(aws_name, {}).get(group, [])
+
+    def get_groups(self, aws_name):
+        if aws_name == ALL:
+            return list(self._get_merged().keys())
+        return list(self.instances.get(aws_name, {}).keys())
 
-    def add_instance(self, aws_name, group, instance):
-        if aws_name not in self.instances:
-            self.instances[aws_name] = {}
+    @property
+    def aws_names(self):
+        return self.instances.keys()
 
-        if group not in self.instances[aws_name]:
-            self.instances[aws_name][group] = []
+    def search(self, aws_name, group, keyword):
+        instances = self.get_instances(aws_name, group)
+        if not keyword or not keyword.strip():
+            return instances
+
+        query = compile_query(keyword)
+        key = aws_name, group, query.key
+        if key in self.results:
+            self.results.move_to_end(key)
+            return self.results[key]
+
+        # the query is usually edited at its end, so an earlier result with
+        # the leading terms only needs the new ones
+        for n in range(len(query.terms) - 1, 0, -1):
+            cached = self.results.get((aws_name, group, query.key[:n]))
+            if cached is not None:
+                instances = cached
+                query = Query(query.terms[n:])
+                break
+
+        self.results[key] = query.filter(instances, self._get_index)
+        if len(self.results) > self.RESULTS_SIZE:
+            self.results.popitem(last=False)
+        return self.results[key]
+
+    def find(self, keyword):
+        # (aws name, instance) of every account matching a query
+        query = compile_query(keyword) if keyword and keyword.strip() \
+            else None
+        for aws_name in self.instances:
+            instances = self.accounts[aws_name]
+            if query is not None:
+                instances = query.filter(instances, self._get_index)
+            for instance in instances:
+                yield aws_name, instance
+
+    def filter(self, instances, keyword):
+        # a query over a list not kept by the manager, it is not cached
+        if not keyword or not keyword.strip():
+            return instances
+        return compile_query(keyword).filter(instances, self._get_index)
+
+    def get_by_ids(self, instance_ids):
+        # the loaded instances of the ids in their order, gone ones skipped
+        values = self._get_index('id').values
+        return [values[i][0] for i in instance_ids if values.get(i)]
+
+    def _get_index(self, field):
+        if field not in self.indexes:
+            with span('manager.index', field=field):
+                self.indexes[field] = Index(
+                    (i for instances in self.accounts.values()
+                     for i in instances), field_values(field))
+        return self.indexes[field]
+
+    def get_dimension(self, aws_name):
+        return self.dimension or self.dimensions[aws_name][0]
+
+    def get_dimensions(self):
+        # configured dimensions first, then every other tag
+        dimensions = []
+        for aws_name in self.pivots:
+            dimensions += [d for d in self.dimensions[aws_name]
+                           if d not in dimensions]
+        tag_keys = set()
+        for aws_name, instances in self.accounts.items():
+            if aws_name not in self.tag_keys:
+                self.tag_keys[aws_name] = set()
+                for instance in instances:
+                    self.tag_keys[aws_name].update(instance.tags)
+            tag_keys.update(self.tag_keys[aws_name])
+        return dimensions + [(k,) for k in sorted(tag_keys, key=natural_key)
+                             if (k,) not in dimensions]
+
+    def regroup(self, dimension):
+        self.dimension = dimension
+        for aws_name in self.pivots:
+            self.instances[aws_name] = self._get_pivot(
+                aws_name, self.get_dimension(aws_name))
+        self.merged = None
+        self.results.clear()
+
+    def sort(self, aws_name=None):
+        # every account, or only the one that changed
+        with span('manager.sort', aws_name=aws_name):
+            self._sort(sorted(self.accounts, key=natural_key)
+                       if aws_name is None else [aws_name])
+
+    def _sort(self, aws_names):
+        # each account is sorted once, the configured groupings are built
+        # from it again and other groupings are dropped
+        for aws_name in aws_names:
+            sort_instances(self.accounts[aws_name], self.get_order(aws_name))
+
+            self.pivots[aws_name] = {}
+            for dimension in self.dimensions[aws_name]:
+                self._build_pivot(aws_name, dimension)
+
+            self.instances[aws_name] = self._get_pivot(
+                aws_name, self.get_dimension(aws_name))
+
+        self.instances = OrderedDict(
+            (aws_name, self.instances[aws_name])
+            for aws_name in sorted(self.instances, key=natural_key))
+        self.merged = None
+        self.results.clear()
+
+    def _get_merged(self):
+        if self.merged is None:
+            self.merged = self._merge()
+        return self.merged
+
+    def _merge(self):
+        # the account lists are already sorted, so sorting their
+        # concatenation only merges the runs
+        order = self.get_order(ALL)
+        everything = []
+        groups = OrderedDict()
+        for aws_name, account_groups in self.instances.items():
+            everything += self.accounts[aws_name]
+            for group, instances in account_groups.items():
+                groups.setdefault(group, []).extend(instances)
+
+        sort_instances(everything, order)
+        merged = OrderedDict([(ALL, everything)])
+        for group in sorted(groups, key=natural_key):
+            sort_instances(groups[group], order)
+            merged[group] = groups[group]
+        return merged
+
+    def get_order(self, aws_name):
+        if aws_name == ALL and not self.order:
+            # the configured order when every account agrees on it
+            orders = set(self.orders.values())
+            return orders.pop() if len(orders) == 1 else DEFAULT_ORDER
+        return self.order or self.orders.get(aws_name, DEFAULT_ORDER)
+
+    def reorder(self, order):
+        self.order = order
+        self.sort()
+
+
+class EC2Provider(Provider):
+    # instances of an aws account, every api call goes through the scheduler
+    credentials = True
+    # ids per describe_instances call when refreshing addresses
+    DESCRIBE_CHUNK = 200
+
+    def _client(self, aws_name):
+        return self.loader.credentials.session(aws_name).client(
+            'ec2', config=CLIENT_CONFIG)
+
+    def request_instances(self, aws_name, config):
+        # pages are requested one by one through the scheduler instead of a
+        # paginator, so each one is retried on its own when throttled
+        client = self._client(aws_name)
+
+        params = {}
+        while True:
+            with span('ec2.request_instances', aws_name=aws_name):
+                page = scheduler.call('ec2.describe_instances',
+                                      client.describe_instances, **params)
+            for revs in page['Reservations']:
+                for aws_instance in revs['Instances']:
+                    yield aws_instance
+
+            if not page.get('NextToken'):
+                return
+            params['NextToken'] = page['NextToken']
+
+    def _request_states(self, aws_name):
+        # every instance including stopped ones, without the descriptions
+        client = self._client(aws_name)
+        states = {}
+        params = {'IncludeAllInstances': True, 'MaxResults': 1000}
+        while True:
+            page = scheduler.call('ec2.describe_instance_status',
+                                  client.describe_instance_status, **params)
+            for status in page['InstanceStatuses']:
+                states[status['InstanceId']] = status['InstanceState']['Name']
+
+            if not page.get('NextToken'):
+                return states
+            params['NextToken'] = page['NextToken']
+
+    def _request_addresses(self, aws_name, instance_ids):
+        client = self._client(aws_name)
+        addresses = {}
+        for start in range(0, len(instance_ids), self.DESCRIBE_CHUNK):
+            response = scheduler.call(
+                'ec2.describe_instances', client.describe_instances,
+                InstanceIds=instance_ids[start:start + self.DESCRIBE_CHUNK])
+            for revs in response['Reservations']:
+                for aws_instance in revs['Instances']:
+                    addresses[aws_instance['InstanceId']] = (
+                        aws_instance.get('PrivateIpAddress'),
+                        aws_instance.get('PublicIpAddress'))
+        return addresses
+
+    def poll_states(self, aws_name, instances):
+        states = self._request_states(aws_name)
+
+        known = {i.id: i for i in instances}
+        if states.keys() != known.keys():
+            return None
+
+        # a started instance usually gets a new public ip
+        started = [i for i, state in states.items()
+                   if state == 'running' and known[i].state != state]
+        addresses = self._request_addresses(aws_name, started) \
+            if started else {}
+        return states, addresses
 
-        self.instances[aws_name][group].append(instance)
+
+class EC2InstanceLoader(object):
+    # instance states can be polled instead of fetching everything again
+    refreshable = True
+    # providers by the 'provider' of an account config, aws by default
+    PROVIDERS = OrderedDict([('ec2', EC2Provider), ('file', FileProvider)])
+    DEFAULT_PROVIDER = 'ec2'
+
+    def __init__(self, config=None, lazy=False):
+        self.config = config if config is not None else Config()
+        self.lazy = lazy
+        self.credentials = CredentialResolver(self.config)
+        self.providers = {name: provider(self)
+                          for name, provider in self.PROVIDERS.items()}
+        # every requested instance per aws name, before filtering
+        self.instances = {}
+        self.fetched_at = {}
+
+    def provider(self, aws_name):
+        name = self.config[aws_name].get('provider', self.DEFAULT_PROVIDER)
+        if name not in self.providers:
+            raise ValueError("Unknown provider '%s' [%s]" % (name, aws_name))
+        return self.providers[name]
+
+    def _request_instances(self, aws_name):
+        # a stream of describe_instances shaped dicts
+        return self.provider(aws_name).request_instances(
+            aws_name, self.config[aws_name])
+
+    def fetch(self, aws_name):
+        fetched_at = time.time()
+
+        config = self.config[aws_name]
+        keep_raw = config.get('keep-raw', False)
+
+        # instances are created while the pages come in
+        with span('loader.fetch', aws_name=aws_name):
+            instances = [EC2Instance(config, aws_instance, keep_raw)
+                         for aws_instance in self._request_instances(aws_name)]
+        self.instances[aws_name] = instances
+        self.fetched_at[aws_name] = fetched_at
+
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('Instance loaded [%s] %d instances', aws_name,
+                      len(instances))
+
+    def poll_states(self, aws_name):
+        # runs in a worker, apply_states uses the result in the main thread.
+        # None when the ids changed, which needs a full fetch
+        with span('loader.poll_states', aws_name=aws_name):
+            instances = self.instances.get(aws_name, [])
+            polled = self.provider(aws_name).poll_states(aws_name, instances)
+            if polled is None:
+                return None
+            states, addresses = polled
+            return instances, states, addresses
+
+    def apply_states(self, aws_name, polled):
+        # the instances are updated in place, the changed ones are returned
+        instances, states, addresses = polled
+        if self.instances.get(aws_name) is not instances:
+            # fetched again while polling
+            return []
+
+        changed = []
+        for instance in instances:
+            state = states[instance.id]
+            address = addresses.get(instance.id)
+            if state == instance.state and address is None:
+                continue
+
+            instance.state = _intern(state)
+            if address is not None:
+                instance.private_ip, instance.public_ip = address
+            elif state != 'running':
+                # a stopped instance releases its public ip
+                instance.public_ip = None
+            instance.touch()
+            changed.append(instance)
+        return changed
+
+    def _resolve_credentials(self, aws_names):
+        self.credentials.resolve_all(
+            n for n in aws_names if self.provider(n).credentials)
+
+    def resolve_interactive(self):
+        # MFA codes of every account are asked up front, the workers of the
+        # ui can not prompt once it owns the terminal
+        self._resolve_credentials(
+            n for n in self.aws_names
+            if 'mfa_serial' in self.config[n].get('credential', {}))
+        self.credentials.interactive = False
+
+    def is_loaded(self, aws_name):
+        return aws_name in self.instances
 
     @property
     def aws_names(self):
-        return self.instances.keys()
+        return sorted((name for name, _ in self.config.items()),
+                      key=natural_key)
 
-    def sort(self):
-        sorted_instances = OrderedDict()
+    def build(self, manager, aws_name):
+        config = self.config[aws_name]
+        connectable = config.get('filter', {}).get('connectable')
 
-        for aws_name, groups in OrderedDict(
-                sorted(self.instances.items(),
-                       key=lambda x: x[0])).items():
+        with span('ec2.build_account', aws_name=aws_name):
+            instances = [i for i in self.instances.get(aws_name, [])
+                         if not connectable or i.is_connectable]
+            manager.set_account(aws_name, instances, group_dimensions(config),
+                                parse_order(config.get('sort')))
 
-            sorted_instances[aws_name] = {}
+    def load_all(self):
+        with paused_gc():
+            return self._load_all()
 
-            for group, instances in OrderedDict(
-                    sorted(groups.items(), key=lambda x: x[0])).items():
-                instances.sort(key=lambda x: x.name)
-                sorted_instances[aws_name][group] = instances
+    def _load_all(self):
+        manager = EC2InstanceManager()
 
-        self.instances = sorted_instances
+        self._resolve_credentials(name for name, _ in self.config.items())
+
+        # accounts of every provider are fetched at once, the scheduler caps
+        # the concurrent api calls
+        aws_names = [name for name, _ in self.config.items()]
+        workers = max(min(scheduler.max_concurrency, len(aws_names)), 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for aws_name in aws_names:
+                console('Instance loading [%s]' % aws_name)
+                futures.append(executor.submit(self.fetch, aws_name))
+            for aws_name, future in zip(aws_names, futures):
+                future.result()
+                self.build(manager, aws_name)
 
+        manager.sort()
 
-class EC2InstanceLoader(object):
-    config = Config()
+        return manager
 
-    def _request_instances(self, aws_name):
-        credential = self.config[aws_name]['credential']
-        session = boto3.Session(
-            aws_access_key_id=credential['aws_access_key_id'],
-            aws_secret_access_key=credential['aws_secret_access_key'],
-            region_name=credential['region'])
+    def load(self, manager, aws_name):
+        console('Instance loading [%s]' % aws_name)
+        self.fetch(aws_name)
+        self.build(manager, aws_name)
+        manager.sort(aws_name)
 
-        client = session.client('ec2')
+    def reload_config(self, manager):
+        # applies a modified config without requesting anything, the accounts
+        # to fetch again are returned. None when the config is unmodified
+        if not self.config.is_modified():
+            return None
 
-        instances = []
-        for revs in client.describe_instances()['Reservations']:
-            instances += revs['Instances']
-        return instances
+        refetch, rederive, removed = self.config.reload()
 
-    def load_all(self):
-        manager = EC2InstanceManager()
+        for aws_name in removed:
+            self.instances.pop(aws_name, None)
+            manager.remove_account(aws_name)
 
-        for aws_name, item in self.config.items():
-            console('Instance loading [%s]' % aws_name)
-            aws_instances = self._request_instances(aws_name)
+        for aws_name in rederive:
+            for ec2_instance in self.instances.get(aws_name, []):
+                ec2_instance.config = self.config[aws_name]
+                ec2_instance.touch()
+            if self.is_loaded(aws_name):
+                self.build(manager, aws_name)
+
+        manager.sort()
 
-            for aws_instance in aws_instances:
-                ec2_instance = EC2Instance(self.config[aws_name], aws_instance)
+        if self.lazy:
+            refetch = set(n for n in refetch if self.is_loaded(n))
+        return refetch
 
-                if self.config[aws_name]['filter'][
-                    'connectable'] and not ec2_instance.is_connectable:
-                    continue
+    def reload(self, manager):
+        refetch = self.reload_config(manager)
+        if refetch is None:
+            return False
 
-                manager.add_instance(aws_name, ec2_instance.group,
-                                     ec2_instance)
+        self._resolve_credentials(refetch)
+
+        for aws_name in refetch:
+            log.info('Instance reloading [%s]', aws_name)
+            self.fetch(aws_name)
+            self.build(manager, aws_name)
 
         manager.sort()
 
-        return manager
+        return True
 
 
 class EC2Instance(object):
     DEFAULT_NAME = "UNKNOWN-NAME"
     DEFAULT_GROUP = "UNKNOWN-GROUP"
 
-    def __init__(self, config, instance):
-        self.config = config
-        self.instance = instance
-
-    @property
-    def tags(self):
-        return {t['Key']: t['Value'] for t in self.instance.get('Tags', {}) if
-                t['Value'] != ''}
+    # only the fields the UI uses are kept from the describe_instances dict,
+    # the rest is dropped at ingest unless keep_raw is set
+    __slots__ = ('config', 'id', 'type', 'state', 'private_ip', 'public_ip',
+                 'aws_key_name', 'launch_time', 'tags', 'raw', 'sort_keys',
+                 'version')
 
-    @property
-    def id(self):
-        return self.instance['InstanceId']
+    def __init__(self, config, instance, keep_raw=False):
+        self.config = config
+        self.id = instance.get('InstanceId')
+        self.type = _intern(instance.get('InstanceType'))
+        self.state = _intern(instance.get('State', {}).get('Name'))
+        self.private_ip = instance.get('PrivateIpAddress')
+        self.public_ip = instance.get('PublicIpAddress')
+        self.aws_key_name = instance.get('KeyName')
+        launch_time = instance.get('LaunchTime')
+        self.launch_time = launch_time.timestamp() if launch_time else None
+        self.tags = {sys.intern(t['Key']): t['Value']
+                     for t in instance.get('Tags', ()) if t['Value'] != ''}
+        self.raw = instance if keep_raw else None
+        self.sort_keys = None
+        self.version = 0
+
+    @classmethod
+    def from_record(cls, config, record):
+        # inverse of to_record, skips the describe_instances projection.
+        # tag keys are expected to be interned by the caller
+        (instance_id, instance_type, state, private_ip, public_ip,
+         aws_key_name, launch_time, tags) = record
+
+        instance = cls.__new__(cls)
+        instance.config = config
+        instance.id = instance_id
+        instance.type = _intern(instance_type)
+        instance.state = _intern(state)
+        instance.private_ip = private_ip
+        instance.public_ip = public_ip
+        instance.aws_key_name = aws_key_name
+        instance.launch_time = launch_time
+        instance.tags = tags
+        instance.raw = None
+        instance.sort_keys = None
+        instance.version = 0
+        return instance
+
+    def sort_key(self, index):
+        # computed on the first sort by a field and kept until the config
+        # changes
+        if self.sort_keys is None:
+            self.sort_keys = [None] * len(SORT_KEYS)
+        key = self.sort_keys[index]
+        if key is None:
+            key = self.sort_keys[index] = SORT_KEYS[index](self)
+        return key
+
+    def reset_sort_keys(self):
+        self.sort_keys = None
+
+    def touch(self):
+        # the config or a field changed, rendered rows are cached by version
+        self.reset_sort_keys()
+        self.version += 1
+
+    def to_record(self):
+        return [self.id, self.type, self.state, self.private_ip,
+                self.public_ip, self.aws_key_name, self.launch_time,
+                self.tags]
 
     @property
     def name(self):
-        if self.config['name-tag'] in self.tags:
-            return self.tags[self.config['name-tag']]
-        return self.id
+        return self.tags.get(self.config.get('name-tag'), self.id)
 
     @property
     def group(self):
-        if self.config['group-tag'] in self.tags:
-            return self.tags[self.config['group-tag']]
-        return self.DEFAULT_GROUP
+        return self.pivot(tag_keys(self.config.get('group-tag')))
 
-    @property
-    def type(self):
-        return self.instance['InstanceType']
+    def pivot(self, tag_keys):
+        for key in tag_keys:
+            if key in self.tags:
+                return self.tags[key]
+        return self.DEFAULT_GROUP
 
     @property
     def key_name(self):
         option = self.config['key-file']['default']
-        key_name = self.instance.get('KeyName') if option == 'auto' else option
+        key_name = self.aws_key_name if option == 'auto' else option
         override = self.config['key-file']
         for group, value in override.get('group', {}).items():
             if group in self.group:
@@ -147,14 +629,6 @@ class EC2Instance(object):
         pem_path = key_path + '.pem'
         return pem_path if isfile(pem_path) else None
 
-    @property
-    def private_ip(self):
-        return self.instance.get('PrivateIpAddress')
-
-    @property
-    def public_ip(self):
-        return self.instance.get('PublicIpAddress')
-
     @property
     def connect_ip(self):
         ip_type = self.config['connect-ip']['default']
@@ -185,10 +659,30 @@ class EC2Instance(object):
 
     @property
     def is_running(self):
-        log.info(self.instance['State'])
-        return self.instance['State']['Name'] == 'running'
+        return self.state == 'running'
 
     @property
     def is_connectable(self):
         return self.is_running and self.has_key_file and \
                self.connect_ip is not None
+
+
+def _intern(value):
+    return sys.intern(value) if value is not None else None
+
+
+def tag_keys(value):
+    # a tag key or a fallback chain of tag keys
+    if value is None:
+        return ()
+    if isinstance(value, str):
+        return (value,)
+    return tuple(value)
+
+
+def group_dimensions(config):
+    dimensions = [tag_keys(config.get('group-tag'))]
+    for value in config.get('pivot-tags', []):
+        if tag_keys(value) not in dimensions:
+            dimensions.append(tag_keys(value))
+    return dimensions
@@ -1,7 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import os
+import time
 import urwid
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
 from urwid import Frame
 
 from urwid import Text
@@ -12,15 +18,24 @@ from urwid import LineBox
 from urwid import ListBox
 
 from .widget import SelectableText
-from .widget import SSHCheckBox
 from .widget import GazuaFrame
 from .widget import ExpadableListWalker
-from .widget import ClippedText
+from .widget import InstanceRow
 
 from . import ec2
 from . import tmux
 
+from .changes import Changes
+from .history import RECENT
+from .history import History
+from .scheduler import scheduler
+from .sort import SORT_FIELDS
+from .state import State
+
+from .profiler import span
+
 from .logger import console
+from .logger import log
 
 
 class Footer(object):
@@ -73,6 +88,8 @@ class AWSView(object):
 
     def update_focus(self):
         widget, pos = self.walker.get_focus()
+        if widget is None:
+            return
         widget.set_attr_map({None: 'aws_focus'})
 
         prev_widget, _ = self.walker.get_prev(pos)
@@ -85,7 +102,11 @@ class AWSView(object):
 
     def get_selected_name(self):
         _, pos = self.walker.get_focus()
-        return self.names[pos]
+        return self.names[pos] if pos is not None else None
+
+    def select_name(self, name):
+        if name in self.names:
+            self.walker.set_focus(self.names.index(name))
 
     def get_walker(self):
         return self.walker
@@ -127,6 +148,8 @@ class GroupView(object):
 
     def update_focus(self):
         widget, pos = self.walker.get_focus()
+        if widget is None:
+            return
         widget.set_attr_map({None: 'group_focus'})
 
         prev_widget, _ = self.walker.get_prev(pos)
@@ -139,11 +162,16 @@ class GroupView(object):
 
     def clear_focus(self):
         widget, _ = self.walker.get_focus()
-        widget.set_attr_map({None: None})
+        if widget is not None:
+            widget.set_attr_map({None: None})
 
     def get_selected_name(self):
         _, pos = self.walker.get_focus()
-        return self.names[pos]
+        return self.names[pos] if pos is not None else None
+
+    def select_name(self, name):
+        if name in self.names:
+            self.walker.set_focus(self.names.index(name))
 
     def get_walker(self):
         return self.walker
@@ -158,9 +186,19 @@ class InstanceView(object):
     walker = None
     listbox = None
 
-    selected_instances = []
-
-    def __init__(self, instances):
+    def __init__(self, instances, on_connect=None, changes=None,
+                 resolve=None):
+        # ids of the selected instances, kept across groups, accounts and
+        # refreshes. resolve gives their current instances when connecting.
+        # rows are the widgets of the listed instances
+        self.selected = OrderedDict()
+        self.resolve = resolve
+        self.rows = {}
+        # a listed recent session is connected as a whole when nothing is
+        # selected
+        self.session = False
+        self.on_connect = on_connect
+        self.changes = changes
         self._init_widgets(instances)
 
     def _init_widgets(self, instances):
@@ -170,42 +208,95 @@ class InstanceView(object):
         self.listbox = ListBox(self.walker)
 
     def update_widgets(self, instances):
-        self.instances = instances
-        self.widgets = self._create_widgets()
-        self.walker = ExpadableListWalker(self.widgets)
-        self.listbox.body = self.walker
-        self.selected_instances = []
+        with span('view.instance_widgets', count=len(instances)):
+            self.instances = instances
+            self.widgets = self._create_widgets()
+            self.walker = ExpadableListWalker(self.widgets)
+            self.listbox.body = self.walker
 
     def _create_widgets(self):
-        return [self._create_widget(i) for i in self.instances]
+        # rows of instances still listed are reused with their canvases,
+        # a search usually narrows the list
+        rows, self.rows = self.rows, {}
+        widgets = []
+        for instance in self.instances:
+            if not instance.is_connectable:
+                # a selected instance stopped since, its row is unchecked
+                self.selected.pop(instance.id, None)
+            row = rows.get(instance.id)
+            if row is None or row.instance is not instance or \
+                    row.version != instance.version or \
+                    row.mark != self._mark(instance):
+                row = self._create_widget(instance)
+            else:
+                row.set_state(instance.id in self.selected, False)
+            self.rows[instance.id] = row
+            widgets.append(row)
+        return widgets
 
     def _create_widget(self, instance):
-        widgets = [
-            (25, SSHCheckBox(
-                instance.name[:21],
-                instance.is_connectable,
-                self._run_tmux,
-                self.not_checkable_callback,
-                on_state_change=self.instance_check_changed,
-                user_data=instance)),
-            (15, ClippedText(instance.private_ip or '-')),
-            (15, ClippedText(instance.public_ip or '-')),
-            (15, ClippedText(instance.type[:15])),
-            (3, ClippedText('O' if instance.is_running else 'X')),
-            ClippedText(instance.key_name or '-'),
-        ]
-
-        columns_widget = Columns(widgets, dividechars=1)
-        return AttrMap(columns_widget, None, 'instance_focus')
+        checked = instance.id in self.selected
+        return InstanceRow(
+            instance,
+            self._cells,
+            instance.is_connectable,
+            self._run_tmux,
+            self.not_checkable_callback,
+            state=checked,
+            on_state_change=self.instance_check_changed,
+            mark=self._mark(instance))
+
+    def _mark(self, instance):
+        return self.changes.get(instance) if self.changes else None
+
+    @staticmethod
+    def _cells(instance):
+        # same widths as the title header, the checkbox takes 4 of the first
+        return (
+            (21, instance.name),
+            (15, instance.private_ip or '-'),
+            (15, instance.public_ip or '-'),
+            (15, instance.type or '-'),
+            (3, 'O' if instance.is_running else 'X'),
+            (None, instance.key_name or '-'),
+        )
 
     def not_checkable_callback(self, instance_name):
         footer.set_text("Instance '%s' is not connectable" % instance_name)
 
     def instance_check_changed(self, widget, state, instance):
         if state:
-            self.selected_instances.append(instance)
+            self.selected[instance.id] = True
         else:
-            self.selected_instances.remove(instance)
+            self.selected.pop(instance.id, None)
+
+    def select(self, instances, state=True):
+        # only the checkboxes of changed instances are updated
+        for instance in instances:
+            if (instance.id in self.selected) == state:
+                continue
+            if state:
+                if not instance.is_connectable:
+                    continue
+                self.selected[instance.id] = True
+            else:
+                del self.selected[instance.id]
+
+            row = self.rows.get(instance.id)
+            if row is not None:
+                row.set_state(state, do_callback=False)
+
+    def invert(self, instances):
+        selected = [i for i in instances if i.id in self.selected]
+        self.select([i for i in instances if i.id not in self.selected])
+        self.select(selected, False)
+
+    def clear(self):
+        for instance_id in self.selected:
+            row = self.rows.get(instance_id)
+            if row is not None:
+                row.set_state(False, do_callback=False)
+        self.selected.clear()
 
     def get_walker(self):
         return self.walker
@@ -214,40 +305,179 @@ class InstanceView(object):
         return self.listbox
 
     def _run_tmux(self):
-        tmux_params = [self._create_tmux_param(i) for i in
-                       self.selected_instances]
-        tmux.run(tmux_params)
-
-    def _create_tmux_param(self, instance):
-        return {
-            'ip_address': instance.connect_ip,
-            'key_file': instance.key_file,
-            'user': instance.user,
-        }
+        # instances gone or stopped since they were selected are dropped
+        instances = [i for i in self.resolve(list(self.selected))
+                     if i.is_connectable] if self.selected else []
+        self.selected = OrderedDict((i.id, True) for i in instances)
+        if not instances and self.session:
+            instances = [i for i in self.instances if i.is_connectable]
+        if instances and self.on_connect:
+            self.on_connect(instances)
+        tmux.run([tmux.create_ssh_param(i) for i in instances])
 
 
 class Gazua(object):
-
-    def __init__(self):
-        loader = ec2.EC2InstanceLoader()
-        self.manager = loader.load_all()
-        if len(self.manager.instances) == 0:
-            console('There is no instances')
+    CONFIG_POLL_INTERVAL = 2
+    # states of loaded instances are polled often, everything is fetched
+    # again rarely or when instances come and go
+    STATE_POLL_INTERVAL = 30
+    FULL_RELOAD_INTERVAL = 600
+
+    def __init__(self, lazy=False, state=None, loader=None, history=None,
+                 ssh_config=None, changes=None):
+        self.state = state if state is not None else State()
+        self.history = history if history is not None else History()
+        self.changes = changes if changes is not None else Changes()
+        self.changes_only = False
+        self.ssh_config = ssh_config
+        self.sessions = []
+        self.session_labels = []
+        self.loader = loader if loader is not None else \
+            ec2.EC2InstanceLoader(lazy=lazy)
+        self.lazy = lazy
+        self.loop = None
+        self.keyword = ''
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self._loading = {}
+        self._loaded_pipe = None
+
+        self.loader.resolve_interactive()
+        if lazy:
+            self.manager = ec2.EC2InstanceManager()
+            aws_name = self._initial_aws_name()
+            self.loader.load(self.manager, aws_name)
+            self.track_changes(aws_name)
+        else:
+            self.manager = self.loader.load_all()
+            if len(self.manager.instances) == 0:
+                console('There is no instances')
+                exit(1)
+            for aws_name in list(self.manager.accounts):
+                self.track_changes(aws_name)
+            if scheduler.totals().retries:
+                footer.set_text(scheduler.status())
+            elif any(self.changes.counts().values()):
+                footer.set_text('%s, F9 to list them' % self._changes_text())
+            self.update_ssh_config()
+
+        with span('view.init'):
+            self._init_views()
+            self._restore_state()
+
+    def _initial_aws_name(self):
+        aws_names = self.loader.aws_names
+        if not aws_names:
+            console('There is no aws account in config')
             exit(1)
 
-        self._init_views()
+        last_aws_name = self.state.get('aws_name')
+        return last_aws_name if last_aws_name in aws_names else aws_names[0]
+
+    def _restore_state(self):
+        aws_name = self.state.get('aws_name')
+        if self.lazy:
+            # ALL or RECENT would load every account at start, the account
+            # loaded for the start is focused instead
+            aws_name = self._initial_aws_name()
+        if aws_name in self.aws_view.names:
+            urwid.disconnect_signal(self.aws_view.get_walker(), "modified",
+                                    self.on_aws_changed)
+            self.aws_view.select_name(aws_name)
+            urwid.connect_signal(self.aws_view.get_walker(), "modified",
+                                 self.on_aws_changed)
+            self.on_aws_changed(self.state.get('group'))
+
+    def save_state(self):
+        self.state.set('aws_name', self.aws_view.get_selected_name())
+        self.state.set('group', self.group_view.get_selected_name())
+        self.state.save()
+
+    def get_aws_names(self):
+        if self.lazy:
+            aws_names = self.loader.aws_names
+        else:
+            aws_names = list(self.manager.aws_names)
+        names = [ec2.ALL] if len(aws_names) > 1 else []
+        if self.history.entries:
+            names.append(RECENT)
+        return names + list(aws_names)
+
+    def get_groups(self, aws_name):
+        # recently used groups first, the merged one stays on top
+        if aws_name == RECENT:
+            self.sessions = self.history.sessions()
+            self.session_labels = self.history.labels(self.sessions)
+            return self.session_labels
+
+        groups = self.manager.get_groups(aws_name)
+        connected = list(self._connected(aws_name))
+        if aws_name == ec2.ALL:
+            return groups[:1] + self.history.rank_groups(groups[1:],
+                                                         connected)
+        return self.history.rank_groups(groups, connected)
+
+    def _connected(self, aws_name):
+        # (id, group) of the connected instances of the account, grouped by
+        # the dimension shown
+        for instance in self.manager.get_by_ids(
+                list(self.history.instance_scores)):
+            name = instance.config.get('name')
+            if aws_name in (ec2.ALL, name):
+                yield instance.id, instance.pivot(
+                    self.manager.get_dimension(name))
+
+    def _get_session(self, group_name):
+        if group_name not in self.session_labels:
+            return None
+        return self.sessions[self.session_labels.index(group_name)]
+
+    def get_instances(self, aws_name, group_name):
+        if aws_name == RECENT:
+            # the current instances of the session, with their current ips
+            session = self._get_session(group_name)
+            if session is None:
+                return []
+            return self.manager.get_by_ids([h[2] for h in session[1]])
+        return self.manager.get_instances(aws_name, group_name)
+
+    def search(self, aws_name, group_name, keyword):
+        if aws_name == RECENT:
+            instances = self.manager.filter(
+                self.get_instances(aws_name, group_name), keyword)
+        else:
+            instances = self.history.rank_instances(
+                self.manager.search(aws_name, group_name, keyword))
+
+        if self.changes_only:
+            instances = [i for i in instances if self.changes.get(i)] + \
+                self.changes.get_gone(aws_name, group_name, keyword,
+                                      self.manager.dimension)
+        return instances
+
+    def _show_instances(self, aws_name, group_name):
+        self.instance_view.session = aws_name == RECENT
+        self.instance_view.update_widgets(
+            self.search(aws_name, group_name, self.keyword))
+
+    def _is_shown(self, aws_name):
+        return self.aws_view.get_selected_name() in (aws_name, ec2.ALL,
+                                                     RECENT)
 
     def _init_views(self):
-        aws_names = list(self.manager.aws_names)
+        aws_names = self.get_aws_names()
         self.aws_view = AWSView(aws_names)
 
         aws_name = self.aws_view.get_selected_name()
-        group_names = list(self.manager.instances[aws_name].keys())
+        group_names = self.get_groups(aws_name)
         self.group_view = GroupView(group_names)
 
         group_name = self.group_view.get_selected_name()
-        init_instances = self.manager.instances[aws_name][group_name]
-        self.instance_view = InstanceView(init_instances)
+        init_instances = self.search(aws_name, group_name, self.keyword)
+        self.instance_view = InstanceView(init_instances,
+                                          on_connect=self.history.record,
+                                          changes=self.changes,
+                                          resolve=self.manager.get_by_ids)
+        self.instance_view.session = aws_name == RECENT
 
         urwid.connect_signal(self.aws_view.get_walker(), "modified",
                              self.on_aws_changed)
@@ -260,7 +490,17 @@ class Gazua(object):
             self.instance_view.get_widget()
         ])
 
-    def on_aws_changed(self):
+    def attach(self, loop):
+        self.loop = loop
+        self._loaded_pipe = loop.watch_pipe(self.on_loaded)
+        loop.set_alarm_in(self.CONFIG_POLL_INTERVAL, self.watch_config)
+        if self.loader.refreshable:
+            loop.set_alarm_in(self.STATE_POLL_INTERVAL, self.watch_states)
+
+        if self.lazy:
+            self._load_around(self.aws_view.get_selected_name())
+
+    def on_aws_changed(self, group_name=None):
         # aws
         self.aws_view.update_focus()
 
@@ -268,22 +508,304 @@ class Gazua(object):
         urwid.disconnect_signal(self.group_view.get_walker(), "modified",
                                 self.on_group_changed)
         aws_name = self.aws_view.get_selected_name()
-        self.group_view.update_widgets(
-            list(self.manager.instances[aws_name].keys()))
+        self.group_view.update_widgets(self.get_groups(aws_name))
+        self.group_view.select_name(group_name)
         urwid.connect_signal(self.group_view.get_walker(), "modified",
                              self.on_group_changed)
 
         # instance
-        group_name = self.group_view.get_selected_name()
-        self.instance_view.update_widgets(
-            self.manager.instances[aws_name][group_name])
+        self._show_instances(aws_name, self.group_view.get_selected_name())
+
+        if self.lazy:
+            self._load_around(aws_name)
+
+    def _load_around(self, aws_name):
+        if self._loaded_pipe is None:
+            return
+
+        names = self.aws_view.names
+        pos = names.index(aws_name)
+
+        if aws_name == ec2.ALL:
+            # every account is merged, so every one has to be loaded
+            for name in self.loader.aws_names:
+                self.request_load(name)
+            return
+
+        if aws_name == RECENT:
+            # the accounts of the sessions
+            for _, hosts in self.sessions:
+                for name in set(h[0] for h in hosts):
+                    if name in self.loader.aws_names:
+                        self.request_load(name)
+            return
+
+        if not self.loader.is_loaded(aws_name):
+            footer.set_text('Instance loading [%s]...' % aws_name)
+            self.request_load(aws_name)
+
+        # prefetch the neighbours, the next one is the most likely to be
+        # focused
+        for neighbour in names[pos + 1:pos + 2] + names[max(pos - 1, 0):pos]:
+            if neighbour not in (ec2.ALL, RECENT):
+                self.request_load(neighbour)
+
+    def _submit(self, key, callback, func, *args):
+        # func runs in the executor, callback gets its future in the main
+        # loop through the pipe
+        if key in self._loading:
+            return
+
+        future = self.executor.submit(func, *args)
+        self._loading[key] = future, callback
+        future.add_done_callback(
+            lambda _: os.write(self._loaded_pipe,
+                               (key + '\n').encode('utf-8')))
+
+    def request_load(self, aws_name, force=False):
+        if not force and self.loader.is_loaded(aws_name):
+            return
+        self._submit('load:' + aws_name, partial(self._on_fetched, aws_name),
+                     self.loader.fetch, aws_name)
+
+    def request_states(self, aws_name):
+        if 'load:' + aws_name in self._loading:
+            return
+        self._submit('states:' + aws_name,
+                     partial(self._on_states_polled, aws_name),
+                     self.loader.poll_states, aws_name)
+
+    def on_loaded(self, data):
+        # called in the main loop after a job of the executor
+        for key in data.decode('utf-8').split('\n'):
+            job = self._loading.pop(key, None)
+            if job is not None:
+                future, callback = job
+                callback(future)
+        return True
+
+    def _on_fetched(self, aws_name, future):
+        if future.exception() is not None:
+            log.error('Instance loading failed [%s]: %s', aws_name,
+                      future.exception())
+            footer.set_text('Instance loading failed [%s]: %s' % (
+                aws_name, future.exception()))
+            return
+
+        self._rebuild(aws_name)
+        if self._is_shown(aws_name):
+            footer.set_text('Instance loaded [%s] %s' % (
+                aws_name, scheduler.status()))
+
+    def _on_states_polled(self, aws_name, future):
+        if future.exception() is not None:
+            log.warning('Instance state polling failed [%s]: %s', aws_name,
+                        future.exception())
+            return
+
+        polled = future.result()
+        if polled is None:
+            log.info('Instances changed [%s], loading them again', aws_name)
+            self.request_load(aws_name, force=True)
+            return
+
+        changed = self.loader.apply_states(aws_name, polled)
+        if changed:
+            self._rebuild(aws_name)
+            footer.set_text('Instance state changed [%s] %s' % (
+                aws_name, ', '.join('%s: %s' % (i.name, i.state)
+                                    for i in changed[:3])))
+
+    def _rebuild(self, aws_name):
+        # filters and sort keys depend on the states, rows are reused for
+        # unchanged instances
+        self.loader.build(self.manager, aws_name)
+        self.manager.sort(aws_name)
+        self.track_changes(aws_name)
+        self.update_ssh_config()
+        if self._is_shown(aws_name):
+            self.refresh()
+
+    def track_changes(self, aws_name):
+        # every instance of the account, the filters do not make it gone
+        if aws_name in self.manager.accounts:
+            self.changes.update(aws_name, self.loader.instances[aws_name],
+                                self.manager.dimensions[aws_name])
+
+    def update_ssh_config(self):
+        # hosts of accounts not loaded yet would be dropped from the file
+        if self.ssh_config is None or not all(
+                self.loader.is_loaded(n) for n in self.loader.aws_names):
+            return
+        self.ssh_config.update(self.manager)
+
+    def watch_states(self, loop, user_data=None):
+        now = time.time()
+        for aws_name in list(self.loader.instances):
+            fetched_at = self.loader.fetched_at.get(aws_name, now)
+            if now - fetched_at >= self.FULL_RELOAD_INTERVAL:
+                self.request_load(aws_name, force=True)
+            else:
+                self.request_states(aws_name)
+
+        loop.set_alarm_in(self.STATE_POLL_INTERVAL, self.watch_states)
 
     def on_group_changed(self):
+        self.update_instances()
+        self.group_view.update_focus()
+
+    def on_search(self, keyword):
+        # an unfinished query keeps the last result
+        try:
+            self.search(self.aws_view.get_selected_name(),
+                        self.group_view.get_selected_name(), keyword)
+        except ValueError as e:
+            footer.set_text(str(e))
+            return
+
+        self.keyword = keyword
+        self.update_instances()
+
+    def update_instances(self):
+        self._show_instances(self.aws_view.get_selected_name(),
+                             self.group_view.get_selected_name())
+
+    def on_key(self, key):
+        if key == 'esc':
+            raise urwid.ExitMainLoop()
+        elif key == 'f2':
+            self.cycle_sort()
+        elif key == 'f3':
+            self.reverse_sort()
+        elif key == 'f4':
+            self.cycle_group()
+        elif key == 'f5':
+            self.select_group()
+        elif key == 'f6':
+            self.select_results()
+        elif key == 'f7':
+            self.invert_selection()
+        elif key == 'f8':
+            self.clear_selection()
+        elif key == 'f9':
+            self.toggle_changes()
+        elif key == 'f10':
+            self.mark_changes_seen()
+
+    def select_group(self):
+        self.instance_view.select(self.get_instances(
+            self.aws_view.get_selected_name(),
+            self.group_view.get_selected_name()))
+        self._selection_changed()
+
+    def select_results(self):
+        self.instance_view.select(self.instance_view.instances)
+        self._selection_changed()
+
+    def invert_selection(self):
+        self.instance_view.invert(self.instance_view.instances)
+        self._selection_changed()
+
+    def clear_selection(self):
+        self.instance_view.clear()
+        self._selection_changed()
+
+    def toggle_changes(self):
+        self.changes_only = not self.changes_only
+        self.update_instances()
+        footer.set_text(self._changes_text() if self.changes_only else
+                        'All instances')
+
+    def mark_changes_seen(self):
+        self.changes.mark_seen()
+        self.update_instances()
+        footer.set_text('Changes marked as seen')
+
+    def _changes_text(self):
+        counts = self.changes.counts()
+        return 'Changes: %d new, %d changed, %d gone' % (
+            counts['new'], counts['changed'], counts['gone'])
+
+    def _selection_changed(self):
+        footer.set_text('Selected: %d' % len(self.instance_view.selected))
+
+    def _current_order(self):
+        return self.manager.order or self.manager.get_order(
+            self.aws_view.get_selected_name())
+
+    def cycle_sort(self):
+        field, _ = self._current_order()[0]
+        index = SORT_FIELDS.index(field)
+        self.reorder(((SORT_FIELDS[(index + 1) % len(SORT_FIELDS)], False),))
+
+    def reverse_sort(self):
+        field, reverse = self._current_order()[0]
+        self.reorder(((field, not reverse),))
+
+    def cycle_group(self):
+        dimensions = self.manager.get_dimensions()
+        if not dimensions:
+            return
+
+        aws_name = self.aws_view.get_selected_name()
+        current = self.manager.dimension or \
+            self.manager.dimensions.get(aws_name, [None])[0]
+        pos = dimensions.index(current) if current in dimensions else -1
+        dimension = dimensions[(pos + 1) % len(dimensions)]
+
+        self.manager.regroup(dimension)
+        self.refresh()
+        footer.set_text('Group: %s' % (' > '.join(dimension) or '-'))
+
+    def reorder(self, order):
+        # instances keep their sort keys, this only re-sorts the lists
+        self.manager.reorder(order)
+        self.update_instances()
+        field, reverse = order[0]
+        footer.set_text('Sort: %s %s' % (field, 'desc' if reverse else 'asc'))
+
+    def on_arrow_pressed(self, column_pos):
+        if column_pos == 0:
+            self.clear_group_focus()
+        elif column_pos == 1:
+            self.update_group_focus()
+
+    def refresh(self):
         aws_name = self.aws_view.get_selected_name()
         group_name = self.group_view.get_selected_name()
-        self.instance_view.update_widgets(
-            self.manager.instances[aws_name][group_name])
-        self.group_view.update_focus()
+
+        urwid.disconnect_signal(self.aws_view.get_walker(), "modified",
+                                self.on_aws_changed)
+        self.aws_view.update_widgets(self.get_aws_names())
+        self.aws_view.select_name(aws_name)
+        urwid.connect_signal(self.aws_view.get_walker(), "modified",
+                             self.on_aws_changed)
+
+        self.on_aws_changed(group_name)
+
+    def watch_config(self, loop, user_data=None):
+        try:
+            # the accounts are fetched again in the executor, only the config
+            # is applied here
+            refetch = self.loader.reload_config(self.manager)
+            if refetch is not None:
+                for aws_name in refetch:
+                    self.request_load(aws_name, force=True)
+                for aws_name in list(self.manager.accounts):
+                    self.track_changes(aws_name)
+                self.update_ssh_config()
+                self.refresh()
+                footer.set_text('Config reloaded')
+        except Exception as e:
+            log.exception('Config reload failed')
+            footer.set_text('Config reload failed: %s' % e)
+
+        loop.set_alarm_in(self.CONFIG_POLL_INTERVAL, self.watch_config)
+
+    def close(self):
+        self.save_state()
+        self.changes.save()
+        self.executor.shutdown(wait=False)
 
     def update_group_focus(self):
         self.group_view.update_focus()
@@ -295,31 +817,18 @@ class Gazua(object):
         return self.view
 
 
-gazua = Gazua()
-
-
-def on_arrow_pressed(column_pos):
-    if column_pos == 0:
-        gazua.clear_group_focus()
-    elif column_pos == 1:
-        gazua.update_group_focus()
-
-
-body = LineBox(gazua.get_view(), tlcorner='═', tline='═', lline='',
-               trcorner='═', blcorner='═', rline='', bline='═', brcorner='═')
-title_header = AttrMap(Columns([
-    (15, Text('aws name      │', wrap='clip')),
-    (25, Text('group                   │', wrap='clip')),
-    (26, Text('instance name            │', wrap='clip')),
-    (16, Text('private ip     │', wrap='clip')),
-    (16, Text('public ip      │', wrap='clip')),
-    (16, Text('type           │', wrap='clip')),
-    (4, Text('run│', wrap='clip')),
-    (Text('key', wrap='clip')),
-]), 'title_header')
+def create_title_header():
+    return AttrMap(Columns([
+        (15, Text('aws name      │', wrap='clip')),
+        (25, Text('group                   │', wrap='clip')),
+        (26, Text('instance name            │', wrap='clip')),
+        (16, Text('private ip     │', wrap='clip')),
+        (16, Text('public ip      │', wrap='clip')),
+        (16, Text('type           │', wrap='clip')),
+        (4, Text('run│', wrap='clip')),
+        (Text('key', wrap='clip')),
+    ]), 'title_header')
 
-body_frame = Frame(body, header=title_header, footer=footer.get_widget())
-wrapper = GazuaFrame(body_frame, arrow_callback=on_arrow_pressed)
 
 palette = [
     ('header', 'white', 'dark red', 'bold'),
@@ -331,15 +840,27 @@ palette = [
     ('aws_focus', 'black', 'dark green'),
     ('group_focus', 'black', 'dark green'),
     ('instance_focus', 'black', 'yellow'),
+    ('instance_new', 'light green', 'default'),
+    ('instance_changed', 'yellow', 'default'),
+    ('instance_gone', 'light red', 'default'),
 ]
 
 
-def key_pressed(key):
-    if key == 'esc':
-        raise urwid.ExitMainLoop()
+def run(lazy=False, loader=None, ssh_config=None):
+    gazua = Gazua(lazy=lazy, loader=loader, ssh_config=ssh_config)
 
+    body = LineBox(gazua.get_view(), tlcorner='═', tline='═', lline='',
+                   trcorner='═', blcorner='═', rline='', bline='═',
+                   brcorner='═')
+    body_frame = Frame(body, header=create_title_header(),
+                       footer=footer.get_widget())
+    wrapper = GazuaFrame(body_frame, arrow_callback=gazua.on_arrow_pressed,
+                         search_callback=gazua.on_search)
 
-def run():
     loop = MainLoop(wrapper, palette, handle_mouse=False,
-                    unhandled_input=key_pressed)
-    loop.run()
+                    unhandled_input=gazua.on_key)
+    gazua.attach(loop)
+    try:
+        loop.run()
+    finally:
+        gazua.close()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import time
+
+from collections import defaultdict
+
+from ec2gazua import utils
+from ec2gazua.logger import log
+
+# pseudo aws name listing the last connected host sets
+RECENT = 'RECENT'
+
+
+class History(object):
+    # connections are appended one json line each, [time, [[aws name,
+    # group, instance id, name], ...]], and ranked by frecency: every
+    # connection counts 1, halved every HALF_LIFE seconds
+    HISTORY_FILE = utils.state_path('history.jsonl')
+    HALF_LIFE = 3 * 24 * 3600
+    # the oldest half is dropped when the file grows over MAX_LINES
+    MAX_LINES = 2000
+    MAX_SESSIONS = 20
+
+    def __init__(self, path=None, now=None):
+        self.path = path or self.HISTORY_FILE
+        self.now = now or time.time
+        self.entries = self._load()
+        self._index()
+
+    def _load(self):
+        try:
+            lines = utils.read(self.path).splitlines()
+        except (IOError, OSError):
+            return []
+
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # a line cut by a crash
+                continue
+
+        if len(entries) > self.MAX_LINES:
+            entries = entries[-self.MAX_LINES // 2:]
+            self._rewrite(entries)
+        return entries
+
+    def _rewrite(self, entries):
+        try:
+            utils.write_private(self.path, ''.join(
+                self._line(e) for e in entries))
+        except (IOError, OSError):
+            log.exception('Failed to compact history')
+
+    @staticmethod
+    def _line(entry):
+        return json.dumps(entry, separators=(',', ':')) + '\n'
+
+    def _index(self):
+        now = self.now()
+        self.instance_scores = defaultdict(float)
+        for connected, hosts in self.entries:
+            weight = 0.5 ** ((now - connected) / self.HALF_LIFE)
+            for _, _, instance_id, _ in hosts:
+                self.instance_scores[instance_id] += weight
+
+    def record(self, instances):
+        hosts = [[i.config.get('name'), i.group, i.id, i.name]
+                 for i in instances]
+        if not hosts:
+            return
+
+        entry = [int(self.now()), hosts]
+        self.entries.append(entry)
+        self._index()
+
+        try:
+            folder = os.path.dirname(self.path)
+            if not os.path.exists(folder):
+                os.makedirs(folder, 0o700)
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+                         0o600)
+            with os.fdopen(fd, 'w') as fp:
+                fp.write(self._line(entry))
+        except (IOError, OSError):
+            log.exception('Failed to save history')
+
+    def sessions(self):
+        # the latest connections first, the same host set only once
+        sessions = []
+        seen = set()
+        for connected, hosts in reversed(self.entries):
+            ids = frozenset(h[2] for h in hosts)
+            if ids in seen:
+                continue
+            seen.add(ids)
+            sessions.append((connected, hosts))
+            if len(sessions) == self.MAX_SESSIONS:
+                break
+        return sessions
+
+    def labels(self, sessions):
+        # '1 3h web-1,web-2' in the order of sessions
+        labels = []
+        now = self.now()
+        for n, (connected, hosts) in enumerate(sessions, 1):
+            labels.append('%d %s %s' % (n, _age(now - connected),
+                                        ','.join(h[3] for h in hosts)))
+        return labels
+
+    def rank_groups(self, groups, connected):
+        # groups with a score first, the others keep their order. connected
+        # is (instance id, group) of the loaded instances in the history, in
+        # the grouping shown, so a regroup ranks its own groups
+        scores = defaultdict(float)
+        for instance_id, group in connected:
+            scores[group] += self.instance_scores.get(instance_id, 0)
+        if not scores:
+            return groups
+
+        ranked = [g for g in groups if g in scores]
+        ranked.sort(key=lambda g: scores[g], reverse=True)
+        return ranked + [g for g in groups if g not in scores]
+
+    def rank_instances(self, instances):
+        scores = self.instance_scores
+        if not scores:
+            return instances
+
+        ranked = [i for i in instances if i.id in scores]
+        if not ranked:
+            return instances
+        ranked.sort(key=lambda i: scores[i.id], reverse=True)
+        return ranked + [i for i in instances if i.id not in scores]
+
+
+def _age(seconds):
+    for unit, size in (('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds >= size:
+            return '%d%s' % (seconds // size, unit)
+    return 'now'
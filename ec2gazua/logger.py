@@ -1,42 +1,65 @@
 # -*- coding: utf-8 -*-
 
+import atexit
 import sys
 import os
 import logging
 import logging.handlers
 
+from queue import Queue
+
 from . import utils
 
 
 class FileLogger(object):
     NAME = 'file_logger'
 
-    LOG_FOLDER = utils.join_path(__file__, '../log')
+    LOG_FOLDER = utils.state_path()
     LOG_FILE = LOG_FOLDER + '/gz.log'
 
-    LOG_LEVEL = {
-        None: logging.INFO,
-        'DEV': logging.DEBUG,
-    }.get(os.environ.get('GZ_ENV'), logging.DEBUG)
+    MAX_BYTES = 1024 * 1024
+    BACKUP_COUNT = 3
+
+    LOG_LEVEL = os.environ.get('GZ_LOG_LEVEL') or {
+        'DEV': 'DEBUG',
+    }.get(os.environ.get('GZ_ENV'), 'WARNING')
 
     LOG_FORMAT = "[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)s] %(" \
                  "message)s "
 
+    listener = None
+
     def create(self):
-        self._create_folder()
         logger = logging.getLogger(self.NAME)
-        fomatter = logging.Formatter(self.LOG_FORMAT)
+        logger.propagate = False
+        set_level(logger, self.LOG_LEVEL)
+
+        # records are formatted and written by a background thread so a log
+        # call never waits on the disk
+        queue = Queue(-1)
+        logger.addHandler(logging.handlers.QueueHandler(queue))
+
+        self.listener = logging.handlers.QueueListener(
+            queue, self._create_file_handler())
+        self.listener.start()
+        atexit.register(self.listener.stop)
+        return logger
 
-        file_handler = logging.FileHandler(self.LOG_FILE)
-        file_handler.setFormatter(fomatter)
+    def _create_file_handler(self):
+        try:
+            self._create_folder()
+            file_handler = logging.handlers.RotatingFileHandler(
+                self.LOG_FILE, maxBytes=self.MAX_BYTES,
+                backupCount=self.BACKUP_COUNT, delay=True)
+        except OSError:
+            file_handler = logging.NullHandler()
 
-        logger.addHandler(file_handler)
-        logger.setLevel(self.LOG_LEVEL)
-        return logger
+        file_handler.setFormatter(logging.Formatter(self.LOG_FORMAT))
+        return file_handler
 
     def _create_folder(self):
         if not os.path.exists(self.LOG_FOLDER):
-            os.makedirs(self.LOG_FOLDER)
+            os.makedirs(self.LOG_FOLDER, 0o700)
 
 
 class ConsoleLogger(object):
@@ -58,6 +81,12 @@ class ConsoleLogger(object):
         self.logger.info(message)
 
 
+def set_level(logger, level):
+    if not isinstance(level, int):
+        level = logging.getLevelName(str(level).upper())
+    logger.setLevel(level if isinstance(level, int) else logging.WARNING)
+
+
 log = FileLogger().create()
 
 console = ConsoleLogger().console
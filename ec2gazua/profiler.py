@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class _NullSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span(object):
+
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, self.start, time.perf_counter(),
+                             self.args)
+        return False
+
+
+class Profiler(object):
+    enabled = False
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans = []
+
+    def enable(self):
+        self.enabled = True
+        self.origin = time.perf_counter()
+        self.spans = []
+
+    def span(self, name, **args):
+        # disabled profiling costs one attribute check per call
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, args)
+
+    def iterate(self, name, iterable, **args):
+        if not self.enabled:
+            return iterable
+        return self._iterate(name, iterable, args)
+
+    def _iterate(self, name, iterable, args):
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.record(name, start, time.perf_counter(), args)
+            yield item
+
+    def record(self, name, start, end, args=None):
+        # list.append is atomic, spans may come from loader threads
+        self.spans.append((name, start, end, threading.get_ident(),
+                           args or {}))
+
+    def summary(self):
+        stats = OrderedDict()
+        for name, start, end, _, _ in sorted(self.spans, key=lambda x: x[1]):
+            count, total, longest = stats.get(name, (0, 0.0, 0.0))
+            elapsed = end - start
+            stats[name] = (count + 1, total + elapsed, max(longest, elapsed))
+        return stats
+
+    def report(self):
+        lines = ['%-32s %7s %11s %11s %11s' % (
+            'span', 'count', 'total(ms)', 'mean(ms)', 'max(ms)')]
+        for name, (count, total, longest) in self.summary().items():
+            lines.append('%-32s %7d %11.2f %11.2f %11.2f' % (
+                name, count, total * 1000, total * 1000 / count,
+                longest * 1000))
+        return '\n'.join(lines)
+
+    def write_trace(self, path):
+        # chrome://tracing / perfetto compatible trace events
+        events = [{
+            'name': name,
+            'ph': 'X',
+            'ts': (start - self.origin) * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': os.getpid(),
+            'tid': tid,
+            'args': args,
+        } for name, start, end, tid, args in self.spans]
+
+        with open(path, 'w') as fp:
+            json.dump({'traceEvents': events}, fp)
+
+
+profiler = Profiler()
+
+span = profiler.span
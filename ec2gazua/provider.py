@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import yaml
+
+from os.path import expanduser
+
+from ec2gazua.profiler import span
+
+
+class Provider(object):
+    # a source of instances for the accounts configured with its name
+    # ('provider: file'). instances are yielded one by one as describe
+    # instances shaped dicts, so every provider gets the same overrides,
+    # filters, sort, indexes, snapshot and agent
+    credentials = False
+
+    def __init__(self, loader):
+        self.loader = loader
+
+    def request_instances(self, aws_name, config):
+        raise NotImplementedError
+
+    def poll_states(self, aws_name, instances):
+        # (states, addresses) of the instances, or None when the account has
+        # to be fetched again
+        return None
+
+
+class FileProvider(Provider):
+    # static hosts from a JSON or YAML file, a list of
+    # {name, id, ip, public-ip, type, state, key, tags}
+    DEFAULT_STATE = 'running'
+
+    def __init__(self, loader):
+        super(FileProvider, self).__init__(loader)
+        self.mtimes = {}
+
+    def request_instances(self, aws_name, config):
+        path = expanduser(config['path'])
+        self.mtimes[aws_name] = os.stat(path).st_mtime
+
+        with span('file.request_instances', aws_name=aws_name), \
+                open(path) as fp:
+            hosts = json.load(fp) if path.endswith('.json') else \
+                yaml.safe_load(fp)
+
+        if isinstance(hosts, dict):
+            hosts = hosts.get('instances')
+        if not isinstance(hosts, list):
+            raise ValueError('Hosts must be a list: %s' % path)
+
+        name_tag = config.get('name-tag', 'Name')
+        for host in hosts:
+            yield self._normalize(host, name_tag, path)
+
+    def _normalize(self, host, name_tag, path):
+        name = host.get('name')
+        instance_id = host.get('id') or name
+        if not instance_id:
+            raise ValueError('Host without name or id: %s' % path)
+
+        tags = [{'Key': str(k), 'Value': str(v)}
+                for k, v in (host.get('tags') or {}).items()]
+        if name:
+            tags.append({'Key': name_tag, 'Value': str(name)})
+
+        return {
+            'InstanceId': str(instance_id),
+            'InstanceType': host.get('type'),
+            'State': {'Name': host.get('state', self.DEFAULT_STATE)},
+            'PrivateIpAddress': host.get('ip'),
+            'PublicIpAddress': host.get('public-ip'),
+            'KeyName': host.get('key'),
+            'Tags': tags,
+        }
+
+    def poll_states(self, aws_name, instances):
+        # an edited file is read again, the states do not change otherwise
+        path = expanduser(self.loader.config[aws_name]['path'])
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+        if mtime != self.mtimes.get(aws_name):
+            return None
+        return {i.id: i.state for i in instances}, {}
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+import ipaddress
+import re
+import shlex
+
+from bisect import bisect_left
+from bisect import bisect_right
+from collections import defaultdict
+from fnmatch import fnmatchcase
+from functools import lru_cache
+
+# values of a field per instance, a field can have more than one value
+FIELDS = {
+    'name': lambda i: (i.name,),
+    'id': lambda i: (i.id,),
+    'state': lambda i: (i.state,),
+    'type': lambda i: (i.type,),
+    'key': lambda i: (i.key_name,),
+    'ip': lambda i: (i.private_ip, i.public_ip),
+    'private-ip': lambda i: (i.private_ip,),
+    'public-ip': lambda i: (i.public_ip,),
+}
+
+_TERM = re.compile(r'^(!?)([^=~!]+)(!=|=|~)(.*)$')
+_MISSING = re.compile(r'^(!?)(.+):missing$')
+_WILDCARDS = re.compile(r'[*?\[]')
+
+
+def field_values(field):
+    if field.startswith('tag:') and len(field) > 4:
+        key = field[4:]
+        return lambda i: (i.tags.get(key),)
+    if field not in FIELDS:
+        raise ValueError("Unknown field '%s'" % field)
+    return FIELDS[field]
+
+
+def _ip_int(value):
+    try:
+        return int(ipaddress.IPv4Address(value))
+    except (ipaddress.AddressValueError, ValueError):
+        return None
+
+
+class Index(object):
+    # instances by value of one field, sorted keys and ips are built on the
+    # first prefix or network lookup
+
+    def __init__(self, instances, values):
+        self.values = defaultdict(list)
+        for instance in instances:
+            for value in values(instance):
+                self.values[value].append(instance)
+        self._keys = None
+        self._ips = None
+        self._ip_keys = None
+
+    def equal(self, value):
+        return set(self.values.get(value, ()))
+
+    def prefix(self, prefix):
+        if self._keys is None:
+            self._keys = sorted(k for k in self.values if k)
+
+        found = set()
+        for key in self._keys[bisect_left(self._keys, prefix):]:
+            if not key.startswith(prefix):
+                break
+            found.update(self.values[key])
+        return found
+
+    def network(self, network):
+        if self._ips is None:
+            ips = sorted((_ip_int(k), k) for k in self.values
+                         if k and _ip_int(k) is not None)
+            self._ips = [ip for ip, _ in ips]
+            self._ip_keys = [key for _, key in ips]
+
+        start = bisect_left(self._ips, int(network.network_address))
+        end = bisect_right(self._ips, int(network.broadcast_address))
+        found = set()
+        for key in self._ip_keys[start:end]:
+            found.update(self.values[key])
+        return found
+
+
+class Term(object):
+    # lookup returns the candidates from an index or None when the term
+    # can not use one, exact terms do not need to match the candidates again
+    exact = False
+
+    def __init__(self, field, value, negate=False):
+        self.field = field
+        self.value = value
+        self.negate = negate
+        self.values = field_values(field)
+
+    @property
+    def key(self):
+        return self.__class__.__name__, self.field, self.value, self.negate
+
+    def lookup(self, get_index):
+        return None
+
+    def match(self, instance):
+        return self._match(instance) != self.negate
+
+    def _match(self, instance):
+        raise NotImplementedError
+
+
+class Contains(Term):
+
+    def __init__(self, value, negate=False):
+        super(Contains, self).__init__('name', value.lower(), negate)
+
+    def _match(self, instance):
+        return self.value in instance.name.lower()
+
+
+class Equal(Term):
+    exact = True
+
+    def lookup(self, get_index):
+        if self.negate:
+            return None
+        return get_index(self.field).equal(self.value)
+
+    def _match(self, instance):
+        return self.value in self.values(instance)
+
+
+class Glob(Term):
+
+    def __init__(self, field, value, negate=False):
+        if not _WILDCARDS.search(value):
+            value = '*%s*' % value
+        super(Glob, self).__init__(field, value, negate)
+        self.prefix = _WILDCARDS.split(value, 1)[0]
+        # 'm5.*' is only a prefix
+        self.exact = self.value == self.prefix + '*'
+
+    def lookup(self, get_index):
+        if self.negate or not self.prefix:
+            return None
+        return get_index(self.field).prefix(self.prefix)
+
+    def _match(self, instance):
+        return any(v is not None and fnmatchcase(v, self.value)
+                   for v in self.values(instance))
+
+
+class Network(Term):
+    exact = True
+
+    def __init__(self, field, value, negate=False):
+        super(Network, self).__init__(field, value, negate)
+        try:
+            self.network = ipaddress.IPv4Network(value, strict=False)
+        except ValueError:
+            raise ValueError("Invalid network '%s'" % value)
+
+    def lookup(self, get_index):
+        if self.negate:
+            return None
+        return get_index(self.field).network(self.network)
+
+    def _match(self, instance):
+        for value in self.values(instance):
+            ip = _ip_int(value) if value else None
+            if ip is not None and int(self.network.network_address) <= ip \
+                    <= int(self.network.broadcast_address):
+                return True
+        return False
+
+
+class Missing(Term):
+
+    def __init__(self, field, negate=False):
+        super(Missing, self).__init__(field, None, negate)
+
+    def _match(self, instance):
+        return not any(self.values(instance))
+
+
+def _parse_term(tokens):
+    token = tokens.pop(0)
+
+    if tokens and tokens[0] == 'in':
+        if len(tokens) < 2:
+            raise ValueError("Missing network after '%s in'" % token)
+        tokens.pop(0)
+        negate = token.startswith('!')
+        return Network(token.lstrip('!'), tokens.pop(0), negate)
+
+    match = _TERM.match(token)
+    if match:
+        negate, field, op, value = match.groups()
+        negate = bool(negate) != (op == '!=')
+        if op == '~':
+            return Glob(field, value, negate)
+        return Equal(field, value, negate)
+
+    match = _MISSING.match(token)
+    if match:
+        negate, field = match.groups()
+        return Missing(field, bool(negate))
+
+    if token.startswith('!'):
+        return Contains(token[1:], True)
+    return Contains(token)
+
+
+class Query(object):
+
+    def __init__(self, terms):
+        self.terms = tuple(terms)
+        self.key = tuple(t.key for t in self.terms)
+
+    def filter(self, instances, get_index):
+        candidates = None
+        residual = []
+        for term in self.terms:
+            found = term.lookup(get_index)
+            if found is None or not term.exact:
+                residual.append(term)
+            if found is not None:
+                candidates = found if candidates is None else \
+                    candidates & found
+
+        if candidates is not None:
+            instances = [i for i in instances if i in candidates]
+        if residual:
+            instances = [i for i in instances
+                         if all(t.match(i) for t in residual)]
+        return instances
+
+
+@lru_cache(maxsize=128)
+def compile_query(text):
+    # 'state=running type~m5.* tag:Env=prod ip in 10.2.0.0/16 !key:missing'
+    # bare words match the name like the plain search
+    try:
+        tokens = shlex.split(text)
+    except ValueError as e:
+        raise ValueError('Invalid query: %s' % e)
+
+    terms = []
+    while tokens:
+        terms.append(_parse_term(tokens))
+    return Query(terms)
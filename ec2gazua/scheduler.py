@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+import random
+import threading
+import time
+
+from collections import OrderedDict
+
+from botocore.config import Config as ClientConfig
+from botocore.exceptions import ClientError
+from botocore.exceptions import ConnectionError as BotoConnectionError
+from botocore.exceptions import HTTPClientError
+
+from ec2gazua.logger import log
+from ec2gazua.profiler import span
+
+THROTTLING_CODES = frozenset([
+    'RequestLimitExceeded', 'Throttling', 'ThrottlingException',
+    'TooManyRequestsException', 'RequestThrottled'])
+
+TRANSIENT_CODES = frozenset([
+    'InternalError', 'ServiceUnavailable', 'Unavailable', 'RequestTimeout'])
+
+# connection errors and timeouts (EndpointConnectionError, ReadTimeoutError,
+# ConnectionClosedError, ...) are retried like the transient codes
+NETWORK_ERRORS = (BotoConnectionError, HTTPClientError)
+
+# retries are made by the scheduler, so they are counted and throttling
+# shrinks the concurrency
+CLIENT_CONFIG = ClientConfig(retries={'max_attempts': 0})
+
+
+def error_code(error):
+    return error.response.get('Error', {}).get('Code')
+
+
+class Metric(object):
+    __slots__ = ('calls', 'retries', 'throttled', 'errors', 'total', 'longest')
+
+    def __init__(self):
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.errors = 0
+        self.total = 0.0
+        self.longest = 0.0
+
+
+class Scheduler(object):
+    # every aws api call of the loaders goes through one scheduler. at most
+    # `limit` calls run at once, throttling halves the limit and each
+    # success grows it back (AIMD), throttled calls are retried with
+    # exponential backoff and full jitter
+    MAX_CONCURRENCY = 8
+    MAX_RETRIES = 6
+    BASE_DELAY = 0.2
+    MAX_DELAY = 10.0
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, sleep=time.sleep):
+        self.max_concurrency = max_concurrency
+        self.limit = float(max_concurrency)
+        self.active = 0
+        self.sleep = sleep
+        self.metrics = OrderedDict()
+        self._condition = threading.Condition()
+
+    def call(self, name, func, *args, **kwargs):
+        attempt = 0
+        while True:
+            self._acquire()
+            start = time.perf_counter()
+            try:
+                with span(name, attempt=attempt):
+                    result = func(*args, **kwargs)
+            except (ClientError,) + NETWORK_ERRORS as e:
+                if isinstance(e, ClientError):
+                    code = error_code(e)
+                    throttled = code in THROTTLING_CODES
+                    transient = throttled or code in TRANSIENT_CODES
+                else:
+                    code = type(e).__name__
+                    throttled = False
+                    transient = True
+                retry = transient and attempt < self.MAX_RETRIES
+                self._release(throttled)
+                self._record(name, start, retry, throttled, error=not retry)
+                if not retry:
+                    raise
+
+                attempt += 1
+                delay = self.backoff(attempt)
+                log.warning('%s failed with %s, retry %d in %.2fs', name,
+                            code, attempt, delay)
+                self.sleep(delay)
+                continue
+            except Exception:
+                self._release(False)
+                self._record(name, start, False, False, error=True)
+                raise
+
+            self._release(False)
+            self._record(name, start, False, False)
+            return result
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.MAX_DELAY,
+                                     self.BASE_DELAY * 2 ** attempt))
+
+    def _acquire(self):
+        with self._condition:
+            while self.active >= int(self.limit):
+                self._condition.wait()
+            self.active += 1
+
+    def _release(self, throttled):
+        with self._condition:
+            self.active -= 1
+            if throttled:
+                self.limit = max(1.0, self.limit / 2)
+            else:
+                self.limit = min(float(self.max_concurrency),
+                                 self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def _record(self, name, start, retry, throttled, error=False):
+        elapsed = time.perf_counter() - start
+        with self._condition:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = Metric()
+            metric.calls += 1
+            metric.retries += retry
+            metric.throttled += throttled
+            metric.errors += error
+            metric.total += elapsed
+            metric.longest = max(metric.longest, elapsed)
+
+    def totals(self):
+        totals = Metric()
+        for m in self.metrics.values():
+            totals.calls += m.calls
+            totals.retries += m.retries
+            totals.throttled += m.throttled
+            totals.errors += m.errors
+            totals.total += m.total
+            totals.longest = max(totals.longest, m.longest)
+        return totals
+
+    def status(self):
+        # one line for the footer
+        totals = self.totals()
+        if not totals.calls:
+            return ''
+        return 'API %d calls, %d retries, %d throttled, %.0fms avg, ' \
+               'concurrency %d/%d' % (
+                   totals.calls, totals.retries, totals.throttled,
+                   totals.total * 1000 / totals.calls, int(self.limit),
+                   self.max_concurrency)
+
+    def report(self):
+        lines = ['%-32s %7s %7s %9s %7s %11s %11s' % (
+            'call', 'count', 'retries', 'throttled', 'errors', 'mean(ms)',
+            'max(ms)')]
+        for name, m in self.metrics.items():
+            lines.append('%-32s %7d %7d %9d %7d %11.2f %11.2f' % (
+                name, m.calls, m.retries, m.throttled, m.errors,
+                m.total * 1000 / m.calls, m.longest * 1000))
+        return '\n'.join(lines)
+
+
+scheduler = Scheduler()
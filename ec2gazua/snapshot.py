@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+import sys
+import time
+
+from ec2gazua.ec2 import EC2Instance
+from ec2gazua.ec2 import EC2InstanceLoader
+from ec2gazua.profiler import span
+from ec2gazua.utils import paused_gc
+
+FORMAT = 'ec2-gz-snapshot'
+VERSION = 1
+
+# instances per line, a line is the unit of streaming
+CHUNK_SIZE = 1000
+
+
+def save(path, loader):
+    with span('snapshot.save'), gzip.open(path, 'wt', compresslevel=6) as fp:
+        dump(fp, loader)
+
+
+def dump(fp, loader):
+    # every requested instance is written, filters are applied again on
+    # load because they depend on local key files
+    _write_line(fp, {'format': FORMAT, 'version': VERSION,
+                     'created': time.time()})
+
+    for aws_name, instances in loader.instances.items():
+        config = {k: v for k, v in loader.config[aws_name].items()
+                  if k != 'credential'}
+        _write_line(fp, ['account', aws_name, config])
+
+        for start in range(0, len(instances), CHUNK_SIZE):
+            _write_line(fp, _encode_chunk(
+                aws_name, instances[start:start + CHUNK_SIZE]))
+
+
+def _encode_chunk(aws_name, instances):
+    # tag keys are written once per chunk, records refer to them by index
+    keys = {}
+    records = []
+    for instance in instances:
+        record = instance.to_record()
+        tags = record[-1]
+        record[-1] = [[keys.setdefault(k, len(keys)) for k in tags],
+                      list(tags.values())]
+        records.append(record)
+    return ['instances', aws_name, [list(keys), records]]
+
+
+def _decode_chunk(chunk):
+    keys, records = chunk
+    keys = [sys.intern(k) for k in keys]
+    for record in records:
+        indexes, values = record[-1]
+        record[-1] = dict(zip([keys[i] for i in indexes], values))
+    return records
+
+
+def load(path):
+    with gzip.open(path, 'rt') as fp:
+        for entry in read(fp, path):
+            yield entry
+
+
+def read(fp, name):
+    # fp is any iterable of lines, yields ('account', aws_name, config) and
+    # ('instances', aws_name, records) while reading
+    lines = iter(fp)
+    header = json.loads(next(lines, None) or 'null')
+    if not isinstance(header, dict) or header.get('format') != FORMAT:
+        raise ValueError('Not an ec2-gz snapshot: %s' % name)
+    if header['version'] > VERSION:
+        raise ValueError(
+            'Unsupported snapshot version %s: %s' % (header['version'], name))
+
+    for line in lines:
+        kind, aws_name, value = json.loads(line)
+        if kind == 'instances':
+            value = _decode_chunk(value)
+        yield kind, aws_name, value
+
+
+def _write_line(fp, data):
+    fp.write(json.dumps(data, separators=(',', ':')))
+    fp.write('\n')
+
+
+class SnapshotConfig(object):
+
+    def __init__(self):
+        self._items = {}
+
+    def is_modified(self):
+        return False
+
+    def items(self):
+        return self._items.items()
+
+    def __contains__(self, aws_name):
+        return aws_name in self._items
+
+    def __getitem__(self, aws_name):
+        return self._items[aws_name]
+
+    def __setitem__(self, aws_name, config):
+        self._items[aws_name] = config
+
+
+class SnapshotLoader(EC2InstanceLoader):
+    # serves instances from a snapshot file instead of boto3
+    refreshable = False
+
+    def __init__(self, path, lazy=False):
+        super(SnapshotLoader, self).__init__(SnapshotConfig(), lazy=lazy)
+        self.path = path
+        self._read()
+
+    def _entries(self):
+        return load(self.path)
+
+    def _read(self):
+        with span('snapshot.load'), paused_gc():
+            for kind, aws_name, value in self._entries():
+                if kind == 'account':
+                    self.config[aws_name] = value
+                    self.instances[aws_name] = []
+                elif kind == 'instances':
+                    config = self.config[aws_name]
+                    self.instances[aws_name] += [
+                        EC2Instance.from_record(config, record)
+                        for record in value]
+
+    def _resolve_credentials(self, aws_names):
+        pass
+
+    def fetch(self, aws_name):
+        pass
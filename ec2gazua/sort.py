@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import re
+import socket
+
+from functools import lru_cache
+
+SORT_FIELDS = ('name', 'launch', 'ip', 'type', 'state')
+
+DEFAULT_ORDER = (('name', False),)
+
+STATE_ORDER = ('running', 'pending', 'stopping', 'stopped', 'shutting-down',
+               'terminated')
+
+_DIGITS = re.compile(r'(\d+)')
+
+
+def natural_key(value):
+    # 'web-10' sorts after 'web-2'. re.split with a group alternates text
+    # and digits, so ints are only ever compared with ints
+    return tuple([int(part) if part.isdecimal() else part
+                  for part in _DIGITS.split(value.lower() if value else '')])
+
+
+@lru_cache(maxsize=None)
+def _cached_natural_key(value):
+    return natural_key(value)
+
+
+def ip_key(ip):
+    try:
+        return 0, int.from_bytes(socket.inet_aton(ip), 'big')
+    except (OSError, TypeError):
+        return 1, 0
+
+
+def launch_key(launch_time):
+    return (0, launch_time) if launch_time is not None else (1, 0)
+
+
+def state_key(state):
+    return STATE_ORDER.index(state) if state in STATE_ORDER else \
+        len(STATE_ORDER)
+
+
+# key functions in the same order as SORT_FIELDS
+SORT_KEYS = (
+    lambda i: natural_key(i.name),
+    lambda i: launch_key(i.launch_time),
+    lambda i: ip_key(i.private_ip),
+    lambda i: _cached_natural_key(i.type),
+    lambda i: state_key(i.state),
+)
+
+
+def parse_order(value):
+    # 'name' or ['state', '-launch'], a leading '-' sorts descending
+    if not value:
+        return DEFAULT_ORDER
+
+    if isinstance(value, str):
+        value = [value]
+
+    order = []
+    for item in value:
+        field = item.lstrip('-')
+        if field not in SORT_FIELDS:
+            raise ValueError('Unknown sort field: %s' % item)
+        order.append((field, item.startswith('-')))
+    return tuple(order)
+
+
+def sort_instances(instances, order):
+    # list.sort is stable, so sorting by each field from the last to the
+    # first one is a multi-key sort that only reads cached keys
+    for field, reverse in reversed(order):
+        index = SORT_FIELDS.index(field)
+        instances.sort(key=lambda i: i.sort_key(index), reverse=reverse)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import re
+
+from collections import Counter
+
+from os.path import exists
+from os.path import expanduser
+
+from ec2gazua import utils
+from ec2gazua.logger import log
+from ec2gazua.profiler import span
+
+HEADER = '# Generated by ec2-gz, do not edit. digest: '
+
+_UNSAFE = re.compile(r'[^\w.-]')
+
+
+class SSHConfig(object):
+    # a Host block per connectable instance for plain ssh, included from
+    # ~/.ssh/config. the file is only kept up to date once it exists, it is
+    # rewritten only when the digest of the blocks changes
+    SSH_CONFIG_FILE = expanduser('~/.ssh/config.d/ec2-gz')
+
+    def __init__(self, path=None):
+        self.path = path or self.SSH_CONFIG_FILE
+        # block per instance id, resolved again when the instance changes
+        self._blocks = {}
+
+    @property
+    def enabled(self):
+        return exists(self.path)
+
+    def update(self, manager):
+        if not self.enabled:
+            return False
+        try:
+            return self.write(manager)
+        except (IOError, OSError):
+            log.exception('Failed to write ssh config [%s]', self.path)
+            return False
+
+    def write(self, manager):
+        with span('ssh_config.write'):
+            content = self.render(manager)
+            digest = hashlib.sha1(content.encode('utf-8')).hexdigest()
+            # the agent and every terminal may write it, the digest in the
+            # file is the one to compare with
+            if digest == self._read_digest():
+                return False
+
+            utils.write_private(self.path, HEADER + digest + '\n' + content)
+        log.info('SSH config written [%s]', self.path)
+        return True
+
+    def _read_digest(self):
+        try:
+            with open(self.path) as fp:
+                line = fp.readline()
+        except (IOError, OSError):
+            return None
+        return line[len(HEADER):].strip() if line.startswith(HEADER) \
+            else None
+
+    def render(self, manager):
+        # ordered by id, so sorting the lists does not change the file
+        instances = sorted((i for instances in manager.accounts.values()
+                            for i in instances), key=_instance_id)
+        # an alias used by more than one instance gets its id appended
+        names = Counter(i.name for i in instances)
+        aliases = {name: _alias(name) for name in names}
+        counts = Counter()
+        for name, count in names.items():
+            counts[aliases[name]] += count
+
+        blocks, self._blocks = self._blocks, {}
+        content = []
+        for instance in instances:
+            key = instance, instance.version, \
+                counts[aliases[instance.name]] > 1
+            cached = blocks.get(instance.id)
+            if cached is None or cached[0] != key:
+                cached = key, _block(instance, key[2])
+            self._blocks[instance.id] = cached
+            if cached[1]:
+                content.append(cached[1])
+        return ''.join(content)
+
+
+def _instance_id(instance):
+    return instance.id or ''
+
+
+def _alias(name):
+    return _UNSAFE.sub('-', name)
+
+
+def _block(instance, duplicated):
+    if not instance.is_connectable:
+        return ''
+
+    alias = _alias(instance.name)
+    if duplicated:
+        alias = '%s.%s' % (alias, instance.id)
+    aliases = [alias] if alias != instance.id else []
+    return ('\nHost %s\n'
+            '    HostName %s\n'
+            '    User %s\n'
+            '    IdentityFile "%s"\n'
+            '    IdentitiesOnly yes\n'
+            '    StrictHostKeyChecking no\n') % (
+        ' '.join(aliases + [instance.id]), instance.connect_ip,
+        instance.user, instance.key_file)
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from ec2gazua import utils
+from ec2gazua.logger import log
+
+
+class State(object):
+    STATE_FILE = utils.state_path('state.json')
+
+    def __init__(self, path=None):
+        self.path = path or self.STATE_FILE
+        self._items = self._load()
+
+    def _load(self):
+        try:
+            return json.loads(utils.read(self.path))
+        except (IOError, ValueError):
+            return {}
+
+    def get(self, key, default=None):
+        return self._items.get(key, default)
+
+    def set(self, key, value):
+        self._items[key] = value
+
+    def save(self):
+        try:
+            utils.write_private(self.path, json.dumps(self._items))
+        except (IOError, OSError):
+            log.exception('Failed to save state')
@@ -5,6 +5,8 @@ import sys
 
 from uuid import uuid4
 
+from ec2gazua.profiler import span
+
 SESSION_PREFIX = "ec2-gz-"
 
 
@@ -41,12 +43,22 @@ def create_tmux_command(ssh_params):
     return commands
 
 
+def create_ssh_param(instance):
+    return {
+        'ip_address': instance.connect_ip,
+        'key_file': instance.key_file,
+        'user': instance.user,
+    }
+
+
 def create_session_name():
     return SESSION_PREFIX + str(uuid4().hex)[:5]
 
 
 def run(ssh_params):
     if len(ssh_params) > 0:
-        commands = create_tmux_command(ssh_params)
-        os.system("; ".join(commands))
+        with span('tmux.create_command', count=len(ssh_params)):
+            commands = create_tmux_command(ssh_params)
+        with span('tmux.run'):
+            os.system("; ".join(commands))
         sys.exit(0)
@@ -1,6 +1,12 @@
 # -*- coding: utf-8 -*-
 
+import gc
+import os
+
+from contextlib import contextmanager
+
 from os.path import dirname
+from os.path import expanduser
 from os.path import join
 from os.path import realpath
 from os.path import isfile
@@ -13,3 +19,47 @@ def join_path(file, path):
 def read(file):
     with open(file) as fp:
         return fp.read()
+
+
+@contextmanager
+def paused_gc():
+    # bulk loading creates many objects that all stay alive, collecting
+    # in between only walks them again and again
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def cache_path(*names):
+    base = os.environ.get('XDG_CACHE_HOME') or expanduser('~/.cache')
+    return join(base, 'ec2-gz', *names)
+
+
+def state_path(*names):
+    base = os.environ.get('XDG_STATE_HOME') or expanduser('~/.local/state')
+    return join(base, 'ec2-gz', *names)
+
+
+def runtime_path(*names):
+    # sockets belong to the per-user runtime dir, the state dir otherwise
+    base = os.environ.get('XDG_RUNTIME_DIR')
+    if not base:
+        return state_path(*names)
+    return join(base, 'ec2-gz', *names)
+
+
+def write_private(file, content):
+    # atomically replace file with a user-only (0600) one
+    folder = dirname(file)
+    if not os.path.exists(folder):
+        os.makedirs(folder, 0o700)
+
+    tmp_file = '%s.%d.tmp' % (file, os.getpid())
+    fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as fp:
+        fp.write(content)
+    os.replace(tmp_file, file)
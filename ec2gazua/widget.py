@@ -3,11 +3,14 @@
 import re
 
 from urwid import AttrMap
-from urwid import CheckBox
 from urwid import Edit
 from urwid import Frame
 from urwid import SimpleFocusListWalker
 from urwid import Text
+from urwid import TextCanvas
+from urwid import Widget
+from urwid import apply_target_encoding
+from urwid import calc_text_pos
 
 
 class ClippedText(Text):
@@ -35,49 +38,137 @@ class SelectableText(Text):
         return key
 
 
-class SSHCheckBox(CheckBox):
-    not_checkable_callback = None
-
-    def __init__(self, label, checkable, enter_callback,
-                 not_checkable_callback, *args, **kwargs):
+class InstanceRow(Widget):
+    # a row of the instance list rendered into one canvas instead of a
+    # Columns of texts, canvases are kept per (instance version, width,
+    # focus, checked) so a redraw only renders rows that changed
+    _sizing = frozenset(['flow'])
+    _selectable = True
+
+    FOCUS_ATTR = 'instance_focus'
+    CACHE_SIZE = 4
+    # marker and attribute of the changes since the last inventory
+    MARKS = {
+        'new': ('+', 'instance_new'),
+        'changed': ('~', 'instance_changed'),
+        'gone': ('-', 'instance_gone'),
+    }
+
+    def __init__(self, instance, cells, checkable, enter_callback,
+                 not_checkable_callback, state=False, on_state_change=None,
+                 mark=None):
+        super(InstanceRow, self).__init__()
+        # cells returns the (width, text) of each column, None is the rest
+        self.instance = instance
+        # the version checkable was computed for
+        self.version = instance.version
+        self.cells = cells
         self.checkable = checkable
+        self.state = bool(state and checkable)
         self.enter_callback = enter_callback
         self.not_checkable_callback = not_checkable_callback
-        super(SSHCheckBox, self).__init__(label, *args, **kwargs)
+        self.on_state_change = on_state_change
+        self.mark = mark
+        self._canvases = {}
+
+    @property
+    def label(self):
+        return self.instance.name
+
+    def get_state(self):
+        return self.state
+
+    def set_state(self, state, do_callback=True):
+        state = bool(state and self.checkable)
+        if state == self.state:
+            return
+        self.state = state
+        self._invalidate()
+        if do_callback and self.on_state_change:
+            self.on_state_change(self, state, self.instance)
 
     def keypress(self, size, key):
         if key == 'enter':
             self.enter_callback()
             return
         elif key == ' ':  # spacebar
-            if not self.checkable and self.not_checkable_callback:
-                self.not_checkable_callback(self.label)
-
-        return super(SSHCheckBox, self).keypress(size, key)
+            if not self.checkable:
+                if self.not_checkable_callback:
+                    self.not_checkable_callback(self.label)
+                return
+            self.set_state(not self.state)
+            return
+        return key
 
-    def set_state(self, state, do_callback=True):
-        if not self.checkable:
-            return super(SSHCheckBox, self).set_state(False, False)
-        return super(SSHCheckBox, self).set_state(state, do_callback)
+    def rows(self, size, focus=False):
+        return 1
+
+    def render(self, size, focus=False):
+        maxcol, = size
+        key = self.instance.version, maxcol, focus, self.state
+        canvas = self._canvases.get(key)
+        if canvas is None:
+            if len(self._canvases) >= self.CACHE_SIZE:
+                self._canvases.clear()
+            canvas = self._canvases[key] = self._render(maxcol, focus)
+        return canvas
+
+    def _render(self, maxcol, focus):
+        # the line is already as wide as the screen, so the canvas is built
+        # directly without the layout of a Text
+        marker, mark_attr = self.MARKS.get(self.mark, (' ', None))
+        line = ('[X]' if self.state else '[ ]') + marker
+        for width, text in self.cells(self.instance):
+            line += text if width is None else _fit(text, width) + ' '
+        text, cs = apply_target_encoding(_fit(line, maxcol))
+        attr = [[(self.FOCUS_ATTR if focus else mark_attr, len(text))]]
+        return TextCanvas([text], attr, [cs], maxcol=maxcol,
+                          check_width=False)
+
+
+def _fit(text, width):
+    # clip or pad to the width in screen columns, not characters
+    if text.isascii():
+        return text[:width].ljust(width)
+    pos, used = calc_text_pos(text, 0, len(text), width)
+    return text[:pos] + ' ' * (width - used)
 
 
 class GazuaFrame(Frame):
     column_pos = 0
+    query_mode = False
 
     def __init__(self, *args, **kwargs):
         self.search_edit = Edit('Search: ')
         self.arrow_callback = kwargs['arrow_callback']
+        self.search_callback = kwargs.get('search_callback')
         super(GazuaFrame, self).__init__(*args,
                                          header=AttrMap(self.search_edit,
                                                         'header'))
 
     def keypress(self, size, key):
+        # '/' starts a query, every printable key including space goes to
+        # the search bar until enter or esc
+        if self.query_mode:
+            if key in ('enter', 'esc'):
+                self.set_query_mode(False)
+                return
+            if len(key) == 1 and key.isprintable():
+                self.search_edit.insert_text(key)
+                self._search_changed()
+                return
+        elif key == '/':
+            self.set_query_mode(True)
+            return
+
         if len(key) == 1 and key.isalpha:
-            if re.compile('^[a-zA-Z0-9]$').match(key):
+            if re.compile(r'^[a-zA-Z0-9=~:.!*_-]$').match(key):
                 self.search_edit.insert_text(key)
+                self._search_changed()
         elif key == 'backspace':
             self.search_edit.set_edit_text(
                 self.search_edit.get_edit_text()[0:-1])
+            self._search_changed()
         elif key == 'left':
             if self.column_pos == 0:
                 self.arrow_callback(None)
@@ -99,6 +190,14 @@ class GazuaFrame(Frame):
 
         return super(GazuaFrame, self).keypress(size, key)
 
+    def set_query_mode(self, query_mode):
+        self.query_mode = query_mode
+        self.search_edit.set_caption('Query: ' if query_mode else 'Search: ')
+
+    def _search_changed(self):
+        if self.search_callback:
+            self.search_callback(self.search_edit.get_edit_text())
+
 
 class ExpadableListWalker(SimpleFocusListWalker):
 
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import time
+
+import pytest
+
+from tests.benchmark.fleet import FleetLoader
+from tests.benchmark.fleet import generate_fleet
+
+# make bench, or GZ_BENCH_SIZES=1000 pytest tests/benchmark
+SIZES = [int(size) for size in
+         os.environ.get('GZ_BENCH_SIZES', '1000').split(',')]
+ACCOUNTS = int(os.environ.get('GZ_BENCH_ACCOUNTS', '3'))
+OUTPUT = os.environ.get('GZ_BENCH_OUTPUT')
+
+results = []
+
+
+@pytest.fixture(scope='module', params=SIZES, ids=lambda x: '%d' % x)
+def size(request):
+    return request.param
+
+
+@pytest.fixture(scope='module')
+def fleet(size):
+    return generate_fleet(size, ACCOUNTS)
+
+
+@pytest.fixture(scope='module')
+def loaded(fleet):
+    loader = FleetLoader(fleet)
+    return loader, loader.load_all()
+
+
+@pytest.fixture
+def bench(size):
+
+    def measure(name, func, budget, repeat=1, count=None):
+        # budget is seconds per instance (or per count items)
+        count = count or size
+        elapsed = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            took = time.perf_counter() - start
+            elapsed = took if elapsed is None else min(elapsed, took)
+
+        results.append({'name': name, 'size': size, 'count': count,
+                        'unit': 's', 'value': elapsed,
+                        'budget': budget * count})
+        assert elapsed <= budget * count, \
+            '%s took %.3fs, budget %.3fs' % (name, elapsed, budget * count)
+        return elapsed
+
+    return measure
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not results:
+        return
+
+    terminalreporter.section('ec2-gazua benchmark')
+    terminalreporter.write_line('%-28s %8s %8s %14s %14s %14s' % (
+        'name', 'size', 'count', 'total', 'per item', 'budget'))
+    for r in results:
+        # seconds are shown in ms (per item in us), memory in KiB (bytes)
+        if r['unit'] == 's':
+            values = ('%.2fms' % (r['value'] * 1e3),
+                      '%.2fus' % (r['value'] * 1e6 / r['count']),
+                      '%.2fms' % (r['budget'] * 1e3))
+        else:
+            values = ('%.1fKiB' % (r['value'] / 1024.0),
+                      '%dB' % (r['value'] / r['count']),
+                      '%.1fKiB' % (r['budget'] / 1024.0))
+        terminalreporter.write_line('%-28s %8d %8d %14s %14s %14s' % (
+            (r['name'], r['size'], r['count']) + values))
+
+    if OUTPUT:
+        with open(OUTPUT, 'w') as fp:
+            json.dump(results, fp, indent=2)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+import random
+
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+
+import botocore.session
+
+from botocore.stub import Stubber
+
+from ec2gazua.ec2 import EC2InstanceLoader
+
+PAGE_SIZE = 1000
+
+# botocore validates every stubbed response against the service model, which
+# is too slow for the largest fleets. Those are served by LocalEC2Client.
+STUB_LIMIT = 10000
+
+TYPES = ['t3.micro', 't3.large', 'm5.large', 'm5.2xlarge', 'c5.xlarge',
+         'r5.4xlarge', 'i3.2xlarge']
+STATES = ['running'] * 8 + ['stopped', 'pending', 'terminated']
+SERVICES = ['api', 'web', 'worker', 'batch', 'search', 'cache', 'gateway']
+ENVS = ['prod', 'stage', 'dev']
+
+
+def account_config(aws_name):
+    return {
+        'name': aws_name,
+        'ssh-path': '~/.ssh',
+        'credential': {'aws_access_key_id': 'xxx',
+                       'aws_secret_access_key': 'xxx',
+                       'region': 'ap-northeast-2'},
+        'group-tag': ['Service', 'aws:autoscaling:groupName'],
+        'pivot-tags': ['Env', ['Team', 'Owner']],
+        'name-tag': 'Name',
+        'filter': {'connectable': False},
+        'connect-ip': {'default': 'private', 'group': {'gateway': 'public'}},
+        'key-file': {'default': 'auto', 'name': {'batch': 'batch-key'}},
+        'user': {'default': 'ec2-user', 'group': {'search': 'ubuntu'}},
+    }
+
+
+def generate_instances(count, seed=0):
+    rand = random.Random(seed)
+    base_time = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    instances = []
+
+    for i in range(count):
+        service = rand.choice(SERVICES)
+        env = rand.choice(ENVS)
+        state = rand.choice(STATES)
+        private_ip = '10.%d.%d.%d' % (i // 65536 % 256, i // 256 % 256,
+                                      i % 256)
+        instance_id = 'i-%017x' % rand.getrandbits(68)
+        eni_id = 'eni-%017x' % rand.getrandbits(68)
+
+        instance = {
+            'AmiLaunchIndex': 0,
+            'ImageId': 'ami-%017x' % rand.getrandbits(68),
+            'InstanceId': instance_id,
+            'InstanceType': rand.choice(TYPES),
+            'KeyName': rand.choice(['deploy', 'admin', 'legacy']),
+            'LaunchTime': base_time + timedelta(
+                minutes=rand.randint(0, 10 ** 6)),
+            'Monitoring': {'State': 'disabled'},
+            'Placement': {'AvailabilityZone': 'ap-northeast-2a',
+                          'GroupName': '', 'Tenancy': 'default'},
+            'PrivateDnsName': 'ip-%s.ec2.internal' % private_ip.replace(
+                '.', '-'),
+            'PrivateIpAddress': private_ip,
+            'ProductCodes': [],
+            'State': {'Code': 16, 'Name': state},
+            'SubnetId': 'subnet-%08x' % rand.getrandbits(32),
+            'VpcId': 'vpc-%08x' % rand.getrandbits(32),
+            'Architecture': 'x86_64',
+            'BlockDeviceMappings': [{
+                'DeviceName': '/dev/xvda',
+                'Ebs': {'AttachTime': base_time, 'DeleteOnTermination': True,
+                        'Status': 'attached',
+                        'VolumeId': 'vol-%017x' % rand.getrandbits(68)},
+            }],
+            'EbsOptimized': False,
+            'Hypervisor': 'xen',
+            'NetworkInterfaces': [{
+                'Attachment': {'AttachTime': base_time,
+                               'AttachmentId': 'eni-attach-%08x' % i,
+                               'DeleteOnTermination': True, 'DeviceIndex': 0,
+                               'Status': 'attached'},
+                'Groups': [{'GroupName': service, 'GroupId': 'sg-%08x' % i}],
+                'MacAddress': '02:00:00:%02x:%02x:%02x' % (
+                    i // 65536 % 256, i // 256 % 256, i % 256),
+                'NetworkInterfaceId': eni_id,
+                'PrivateIpAddress': private_ip,
+                'PrivateIpAddresses': [{'Primary': True,
+                                        'PrivateIpAddress': private_ip}],
+                'SourceDestCheck': True,
+                'Status': 'in-use',
+            }],
+            'RootDeviceName': '/dev/xvda',
+            'RootDeviceType': 'ebs',
+            'SecurityGroups': [{'GroupName': service,
+                                'GroupId': 'sg-%08x' % i}],
+            'SourceDestCheck': True,
+            'Tags': [
+                {'Key': 'Name', 'Value': '%s-%s-%d' % (env, service, i)},
+                {'Key': 'Service', 'Value': service},
+                {'Key': 'Env', 'Value': env},
+                {'Key': 'Team', 'Value': 'team-%d' % (i % 17)},
+                {'Key': 'Owner', 'Value': 'owner-%d' % (i % 101)},
+                {'Key': 'CostCenter', 'Value': 'cc-%d' % (i % 13)},
+                {'Key': 'aws:autoscaling:groupName',
+                 'Value': '%s-%s-asg' % (env, service)},
+                {'Key': 'Version', 'Value': 'v%d.%d' % (i % 5, i % 11)},
+            ],
+            'VirtualizationType': 'hvm',
+            'MetadataOptions': {'State': 'applied', 'HttpTokens': 'required',
+                                'HttpPutResponseHopLimit': 2,
+                                'HttpEndpoint': 'enabled'},
+        }
+        if state == 'running' and service == 'gateway':
+            instance['PublicIpAddress'] = '3.%d.%d.%d' % (
+                i // 65536 % 256, i // 256 % 256, i % 256)
+        instances.append(instance)
+
+    return instances
+
+
+def describe_pages(instances, page_size=PAGE_SIZE):
+    pages = []
+    for start in range(0, max(len(instances), 1), page_size):
+        chunk = instances[start:start + page_size]
+        page = {'Reservations': [{
+            'OwnerId': '123456789012',
+            'ReservationId': 'r-%08x' % (start + i),
+            'Instances': [instance],
+        } for i, instance in enumerate(chunk)]}
+        if start + page_size < len(instances):
+            page['NextToken'] = 'token-%d' % (start + page_size)
+        pages.append(page)
+    return pages
+
+
+def stub_client(pages):
+    client = botocore.session.get_session().create_client(
+        'ec2', region_name='ap-northeast-2', aws_access_key_id='xxx',
+        aws_secret_access_key='xxx')
+    stubber = Stubber(client)
+    for page in pages:
+        stubber.add_response('describe_instances', page)
+    stubber.activate()
+    return client, stubber
+
+
+class LocalEC2Client(object):
+    # stand-in for the ec2 client with the pages already in memory
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.positions = {page.get('NextToken'): n + 1
+                          for n, page in enumerate(pages)}
+
+    def describe_instances(self, NextToken=None, **kwargs):
+        return self.pages[self.positions[NextToken] if NextToken else 0]
+
+
+class StubSession(object):
+
+    def __init__(self, client):
+        self._client = client
+
+    def client(self, service_name, **kwargs):
+        return self._client
+
+
+class FleetLoader(EC2InstanceLoader):
+    # EC2InstanceLoader serving describe_instances from botocore stubbers
+
+    def __init__(self, fleet, stub=True, **kwargs):
+        config = {aws_name: account_config(aws_name) for aws_name in fleet}
+        super(FleetLoader, self).__init__(config, **kwargs)
+        # stubbed responses are validated here, outside of the measurements
+        self.sessions = {}
+        self.stubbers = {}
+        for aws_name, instances in fleet.items():
+            pages = describe_pages(instances)
+            if not stub or len(instances) > STUB_LIMIT:
+                client = LocalEC2Client(pages)
+            else:
+                client, self.stubbers[aws_name] = stub_client(pages)
+            self.sessions[aws_name] = StubSession(client)
+
+        self.credentials.session = self.sessions.__getitem__
+        self.credentials.resolve_all = lambda aws_names: None
+
+
+def generate_fleet(count, accounts=3, seed=0):
+    instances = generate_instances(count, seed)
+    return {'aws-%d' % n: instances[n::accounts] for n in range(accounts)}
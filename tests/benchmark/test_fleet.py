@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+import gc
+import os
+import random
+import tracemalloc
+
+import pytest
+
+from urwid import CanvasCache
+
+from ec2gazua import snapshot
+from ec2gazua import tmux
+from ec2gazua.changes import Changes
+from ec2gazua.ec2 import ALL
+from ec2gazua.gazua import InstanceView
+from ec2gazua.snapshot import SnapshotLoader
+from ec2gazua.sort import natural_key
+from ec2gazua.sshconfig import SSHConfig
+
+from tests.benchmark.conftest import results
+from tests.benchmark.fleet import FleetLoader
+from tests.benchmark.fleet import generate_fleet
+
+# the budgets are wall clock, so they are only checked when asked for
+pytestmark = pytest.mark.skipif(
+    'GZ_BENCH_SIZES' not in os.environ,
+    reason='benchmark, run with make bench or set GZ_BENCH_SIZES')
+
+# budgets are seconds per instance, generous enough for a slow CI box
+LOAD_BUDGET = 200e-6
+SORT_BUDGET = 20e-6
+REGROUP_BUDGET = 0.1e-6
+VIEW_BUDGET = 500e-6
+# seconds per visible row of a full redraw
+RENDER_BUDGET = 100e-6
+CACHED_RENDER_BUDGET = 40e-6
+SEARCH_BUDGET = 30e-6
+QUERY_BUDGET = 30e-6
+TMUX_BUDGET = 1e-3
+# a 50k instance snapshot loads in about a second on a slow single core
+SNAPSHOT_BUDGET = 30e-6
+# an unchanged inventory is only compared with the file
+SSH_CONFIG_BUDGET = 5e-6
+# fingerprinting and comparing a refreshed account
+CHANGES_BUDGET = 10e-6
+
+RENDER_SIZE = 200, 200
+
+# retained bytes per instance after loading
+MEMORY_BUDGET = 2 * 1024
+
+
+def _all_instances(manager):
+    return [i for groups in manager.instances.values()
+            for instances in groups.values() for i in instances]
+
+
+def test_load(fleet, size, bench):
+    loader = FleetLoader(fleet)
+    manager = None
+
+    def load():
+        nonlocal manager
+        manager = loader.load_all()
+
+    bench('load_all', load, LOAD_BUDGET)
+    assert len(_all_instances(manager)) == size
+    for stubber in loader.stubbers.values():
+        stubber.assert_no_pending_responses()
+
+
+def test_load_memory(size):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+
+        loader = FleetLoader(generate_fleet(size), stub=False)
+        manager = loader.load_all()
+        # only what the loader and manager keep after the response is gone
+        loader.sessions = loader.credentials = None
+        gc.collect()
+
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    per_instance = (retained - before) / size
+    results.append({'name': 'load_all memory', 'size': size, 'count': size,
+                    'unit': 'B', 'value': retained - before,
+                    'budget': MEMORY_BUDGET * size})
+    assert len(_all_instances(manager)) == size
+    assert per_instance <= MEMORY_BUDGET, \
+        'retained %d bytes per instance (peak %d)' % (per_instance, peak)
+
+
+def test_sort(loaded, bench):
+    _, manager = loaded
+    rand = random.Random(0)
+    for groups in manager.instances.values():
+        for instances in groups.values():
+            rand.shuffle(instances)
+
+    bench('manager.sort', manager.sort, SORT_BUDGET)
+
+    for groups in manager.instances.values():
+        for instances in groups.values():
+            names = [natural_key(i.name) for i in instances]
+            assert names == sorted(names)
+
+
+def test_reorder(loaded, bench):
+    _, manager = loaded
+
+    try:
+        bench('manager.reorder', lambda: manager.reorder(
+            (('state', False), ('launch', True))), SORT_BUDGET)
+    finally:
+        manager.reorder(None)
+
+
+def test_regroup(loaded, bench):
+    _, manager = loaded
+
+    try:
+        # prebuilt pivot, only swapped in
+        bench('manager.regroup prebuilt', lambda: manager.regroup(('Env',)),
+              REGROUP_BUDGET, repeat=3)
+        assert set(manager.get_groups('aws-0')) == {'prod', 'stage', 'dev'}
+
+        bench('manager.regroup new tag',
+              lambda: manager.regroup(('CostCenter',)), SORT_BUDGET)
+    finally:
+        manager.regroup(None)
+
+
+def test_view_construction(loaded, bench):
+    _, manager = loaded
+    instances = max((i for groups in manager.instances.values()
+                     for i in groups.values()), key=len)
+
+    bench('InstanceView', lambda: InstanceView(instances), VIEW_BUDGET,
+          repeat=3, count=len(instances))
+
+
+def test_view_render(loaded, bench):
+    _, manager = loaded
+    width, rows = RENDER_SIZE
+    view = InstanceView(_all_instances(manager)[:rows])
+
+    def render():
+        # urwid only keeps weak references to canvases, dropping them asks
+        # every row again like a redraw after the screen was released
+        CanvasCache.clear()
+        view.listbox.render(RENDER_SIZE, focus=True)
+
+    def render_cold():
+        for row in view.rows.values():
+            row._canvases.clear()
+        render()
+
+    bench('InstanceView render', render_cold, RENDER_BUDGET, repeat=3,
+          count=rows)
+    bench('InstanceView render cached', render, CACHED_RENDER_BUDGET,
+          repeat=3, count=rows)
+
+
+def test_search(loaded, bench):
+    _, manager = loaded
+    found = []
+
+    def search():
+        # the cached results of the last run would be measured otherwise
+        manager.results.clear()
+        del found[:]
+        for aws_name, groups in manager.instances.items():
+            for group in groups:
+                found.extend(manager.search(aws_name, group, 'prod-api-1'))
+
+    bench('manager.search', search, SEARCH_BUDGET, repeat=3)
+    assert all('prod-api-1' in i.name for i in found)
+
+
+def test_search_all(loaded, bench):
+    # the merged index is built by sort, focusing ALL only reads it
+    _, manager = loaded
+    found = []
+
+    def search():
+        manager.results.clear()
+        del found[:]
+        found.extend(manager.search(ALL, ALL, 'prod-api-1'))
+
+    bench('manager.search_all', search, SEARCH_BUDGET, repeat=3)
+    assert found and all('prod-api-1' in i.name for i in found)
+
+
+def test_query(loaded, bench):
+    _, manager = loaded
+    query = 'state=running type~m5.* ip in 10.0.0.0/9 !key:missing'
+    found = []
+
+    def search():
+        # the indexes stay, only the cached results are dropped
+        manager.results.clear()
+        del found[:]
+        found.extend(manager.search(ALL, ALL, query))
+
+    bench('manager.search query', search, QUERY_BUDGET, repeat=3)
+    assert found
+    assert all(i.state == 'running' and i.type.startswith('m5.')
+               for i in found)
+
+
+def test_tmux_command(loaded, bench):
+    _, manager = loaded
+    params = [{'ip_address': i.connect_ip, 'key_file': i.key_file,
+               'user': i.user} for i in _all_instances(manager)[:50]]
+
+    bench('tmux.create_tmux_command',
+          lambda: tmux.create_tmux_command(params), TMUX_BUDGET,
+          repeat=3, count=len(params))
+
+
+def test_snapshot_load(loaded, size, tmpdir, bench):
+    loader, _ = loaded
+    path = str(tmpdir.join('fleet.gz'))
+    snapshot.save(path, loader)
+
+    bench('snapshot load', lambda: SnapshotLoader(path).load_all(),
+          SNAPSHOT_BUDGET, repeat=3)
+
+
+def test_ssh_config(loaded, tmpdir, bench):
+    _, manager = loaded
+    ssh_config = SSHConfig(str(tmpdir.join('ec2-gz')))
+    ssh_config.write(manager)
+
+    bench('ssh_config unchanged', lambda: ssh_config.update(manager),
+          SSH_CONFIG_BUDGET, repeat=3)
+    assert not ssh_config.update(manager)
+
+
+def test_changes(loaded, tmpdir, bench):
+    loader, manager = loaded
+    changes = Changes(str(tmpdir))
+    for aws_name, instances in loader.instances.items():
+        changes.update(aws_name, instances, manager.dimensions[aws_name])
+
+    def update():
+        for aws_name, instances in loader.instances.items():
+            changes.update(aws_name, instances, manager.dimensions[aws_name])
+
+    bench('changes.update', update, CHANGES_BUDGET, repeat=3)
+    assert not any(changes.counts().values())
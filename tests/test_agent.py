@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import os
+import stat
+import threading
+
+import mock
+
+from ec2gazua import agent
+from ec2gazua.ec2 import EC2Instance
+
+CONFIG = {'name': 'my-aws', 'credential': {'aws_access_key_id': 'xxx1'},
+          'group-tag': 'Team', 'name-tag': 'Name',
+          'filter': {'connectable': False}}
+
+RAW = {'InstanceId': 'i-1', 'InstanceType': 't2.micro',
+       'State': {'Name': 'running'},
+       'Tags': [{'Key': 'Name', 'Value': 'web-1'},
+                {'Key': 'Team', 'Value': 'ho'}]}
+
+
+class MockLoader(object):
+
+    def __init__(self, name='web-1'):
+        raw = dict(RAW, Tags=[{'Key': 'Name', 'Value': name},
+                              {'Key': 'Team', 'Value': 'ho'}])
+        self.config = {'my-aws': CONFIG}
+        self.instances = {'my-aws': [EC2Instance(CONFIG, raw)]}
+
+    def load_all(self):
+        pass
+
+
+def test_agent_serves_inventory(tmpdir):
+    path = str(tmpdir.join('agent.sock'))
+    server = agent.Agent(path, create_loader=MockLoader)
+    thread = threading.Thread(target=server.serve)
+    thread.start()
+    try:
+        server.ready.wait(5)
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+        manager = agent.AgentLoader(path).load_all()
+        assert [i.name for i in manager.get_instances('my-aws', 'ho')] == \
+            ['web-1']
+        assert agent.call('status', path)['instances'] == 1
+    finally:
+        agent.call('stop', path)
+        thread.join(5)
+
+    assert not thread.is_alive()
+    assert not os.path.exists(path)
+
+
+def test_agent_loader_follows_refreshes(tmpdir):
+    path = str(tmpdir.join('agent.sock'))
+    server = agent.Agent(path, create_loader=MockLoader)
+    thread = threading.Thread(target=server.serve)
+    thread.start()
+    try:
+        server.ready.wait(5)
+        loader = agent.AgentLoader(path)
+        assert loader.refreshable
+        assert loader.poll_states('my-aws') is not None
+
+        server.create_loader = lambda: MockLoader('web-2')
+        server.refresh()
+        assert loader.poll_states('my-aws') is None
+        loader.fetch('my-aws')
+        assert [i.name for i in loader.instances['my-aws']] == ['web-2']
+        assert loader.poll_states('my-aws') is not None
+    finally:
+        agent.call('stop', path)
+        thread.join(5)
+
+
+@mock.patch('ec2gazua.agent.EC2InstanceLoader')
+def test_agent_falls_back_to_in_process_loading(loader, tmpdir, monkeypatch):
+    monkeypatch.setattr(agent, 'socket_path',
+                        lambda: str(tmpdir.join('missing.sock')))
+    assert agent.create_loader() is loader.return_value
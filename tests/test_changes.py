@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from ec2gazua.changes import CHANGED
+from ec2gazua.changes import GONE
+from ec2gazua.changes import NEW
+from ec2gazua.changes import Changes
+from ec2gazua.ec2 import ALL
+from ec2gazua.ec2 import EC2Instance
+
+CONFIG = {'name': 'my/aws', 'name-tag': 'Name', 'group-tag': 'Env',
+          'pivot-tags': ['Team']}
+DIMENSIONS = [('Env',), ('Team',)]
+
+
+def _create(name, ip, env='prod'):
+    return EC2Instance(CONFIG, {'InstanceId': 'i-' + name,
+                                'PrivateIpAddress': ip,
+                                'Tags': [{'Key': 'Name', 'Value': name},
+                                         {'Key': 'Env', 'Value': env},
+                                         {'Key': 'Team', 'Value': 'ops'},
+                                         {'Key': 'Owner', 'Value': 'me'}]})
+
+
+def test_changes_between_runs(tmpdir):
+    folder = str(tmpdir.join('fingerprints'))
+    web, db = _create('web', '10.0.0.1'), _create('db', '10.0.0.2', 'dev')
+
+    changes = Changes(folder)
+    # nothing changed on the first run
+    changes.update('my/aws', [web, db], DIMENSIONS)
+    assert changes.get(web) is None
+    assert changes.counts() == {NEW: 0, CHANGED: 0, GONE: 0}
+    changes.save()
+    assert os.listdir(folder) == ['my_aws.json']
+
+    moved, cache = _create('web', '10.0.0.9'), _create('cache', '10.0.0.3')
+    changes = Changes(folder)
+    changes.update('my/aws', [moved, cache], DIMENSIONS)
+    assert changes.get(moved) == CHANGED
+    assert changes.get(cache) == NEW
+    gone, = changes.get_gone('my/aws', 'dev')
+    assert (gone.id, gone.name, changes.get(gone)) == ('i-db', 'db', GONE)
+    assert changes.get_gone('my/aws', 'prod') == []
+    assert changes.get_gone(ALL, ALL, 'd') == [gone]
+    assert changes.get_gone(ALL, ALL, 'state=running') == []
+    # grouped like the list once regrouped by another tag
+    assert changes.get_gone('my/aws', 'ops', dimension=('Team',)) == [gone]
+    assert changes.get_gone('my/aws', 'dev', dimension=('Team',)) == []
+    assert gone.tags == {'Env': 'dev', 'Team': 'ops'}
+
+    # still compared with the last run until marked as seen
+    changes.update('my/aws', [moved, cache], DIMENSIONS)
+    assert changes.counts() == {NEW: 1, CHANGED: 1, GONE: 1}
+    changes.mark_seen()
+    assert changes.counts() == {NEW: 0, CHANGED: 0, GONE: 0}
@@ -61,3 +61,34 @@ def test_valid_config_file(_):
         Config()
 
     assert 'my-aws is duplicated name in config' == str(e.value)
+
+
+config_yaml3 = config_yaml1.replace('test2: leejuhyun', 'test2: ubuntu') \
+    .replace('aws_access_key_id: asd1', 'aws_access_key_id: asd9')
+
+
+@mock.patch('ec2gazua.config.Config._stat', side_effect=[1, 1, 2, 2])
+@mock.patch('ec2gazua.config.Config._read',
+            side_effect=[config_yaml1, config_yaml3])
+def test_reload_classifies_changes(mock_read, _):
+    config = Config()
+    assert not config.is_modified()
+    assert config.is_modified()
+
+    refetch, rederive, removed = config.reload()
+
+    assert refetch == {'enterprise'}
+    assert rederive == {'my-aws'}
+    assert removed == set()
+    assert config['my-aws']['user']['name'] == {'test2': 'ubuntu'}
+    assert mock_read.call_count == 2
+
+
+@mock.patch('ec2gazua.config.Config._read',
+            return_value='log-level: DEBUG\n---\n' + config_yaml1)
+def test_settings_document(_):
+    config = Config()
+
+    assert config.settings == {'log-level': 'DEBUG'}
+    assert sorted(name for name, _ in config.items()) == \
+        ['enterprise', 'my-aws']
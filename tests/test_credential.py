@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+import os
+import stat
+import time
+
+import mock
+import pytest
+
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+
+from ec2gazua.credential import CredentialCache
+from ec2gazua.credential import CredentialResolver
+
+ROLE_CONFIG = {
+    'my-aws': {
+        'credential': {
+            'profile': 'base',
+            'role_arn': 'arn:aws:iam::123456789012:role/read-only',
+            'region': 'ap-northeast-2',
+        }
+    }
+}
+
+
+def _assume_role_response(expires_in=3600):
+    return {
+        'Credentials': {
+            'AccessKeyId': 'ASIA',
+            'SecretAccessKey': 'secret',
+            'SessionToken': 'token',
+            'Expiration': datetime.now(timezone.utc) +
+            timedelta(seconds=expires_in),
+        }
+    }
+
+
+def test_credential_cache_private_file(tmpdir):
+    path = str(tmpdir.join('ec2-gz', 'credentials.json'))
+    cache = CredentialCache(path)
+    cache.set('key', {'Expiration': time.time() + 3600})
+
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert CredentialCache(path).get('key') is not None
+
+
+def test_credential_cache_ignores_expiring(tmpdir):
+    cache = CredentialCache(str(tmpdir.join('credentials.json')))
+    cache.set('key', {'Expiration': time.time() + 10})
+
+    assert cache.get('key') is None
+
+
+@mock.patch('ec2gazua.credential.boto3')
+def test_credential_resolver_reuses_cached_role(mock_boto3, tmpdir):
+    sts = mock_boto3.Session.return_value.client.return_value
+    sts.assume_role.return_value = _assume_role_response()
+    path = str(tmpdir.join('credentials.json'))
+
+    CredentialResolver(ROLE_CONFIG, CredentialCache(path)).session('my-aws')
+    CredentialResolver(ROLE_CONFIG, CredentialCache(path)).session('my-aws')
+
+    assert sts.assume_role.call_count == 1
+    mock_boto3.Session.assert_called_with(
+        aws_access_key_id='ASIA',
+        aws_secret_access_key='secret',
+        aws_session_token='token',
+        region_name='ap-northeast-2')
+
+
+@mock.patch('ec2gazua.credential.boto3')
+def test_credential_resolver_renews_expiring_role(mock_boto3, tmpdir):
+    sts = mock_boto3.Session.return_value.client.return_value
+    sts.assume_role.return_value = _assume_role_response(expires_in=60)
+    resolver = CredentialResolver(
+        ROLE_CONFIG, CredentialCache(str(tmpdir.join('credentials.json'))))
+
+    resolver.session('my-aws')
+    resolver.session('my-aws')
+
+    assert sts.assume_role.call_count == 2
+
+
+@mock.patch('ec2gazua.credential.boto3')
+def test_credential_resolver_rebuilds_edited_secret(mock_boto3, tmpdir):
+    credential = {'aws_access_key_id': 'xxx1',
+                  'aws_secret_access_key': 'WRONG',
+                  'region': 'ap-northeast-2'}
+    config = {'my-aws': {'credential': credential}}
+    resolver = CredentialResolver(
+        config, CredentialCache(str(tmpdir.join('credentials.json'))))
+    mock_boto3.Session.side_effect = lambda **kwargs: mock.Mock(**kwargs)
+
+    session = resolver.session('my-aws')
+    assert resolver.session('my-aws') is session
+
+    # a reloaded config has the fixed secret
+    config['my-aws'] = {'credential': dict(credential,
+                                           aws_secret_access_key='xxx2')}
+    renewed = resolver.session('my-aws')
+    assert renewed is not session
+    assert renewed.aws_secret_access_key == 'xxx2'
+
+
+@mock.patch('ec2gazua.credential.input', create=True)
+@mock.patch('ec2gazua.credential.boto3')
+def test_credential_resolver_mfa_without_terminal(mock_boto3, mock_input,
+                                                  tmpdir):
+    config = {'my-aws': {'credential': dict(
+        ROLE_CONFIG['my-aws']['credential'],
+        mfa_serial='arn:aws:iam::123456789012:mfa/me')}}
+    resolver = CredentialResolver(
+        config, CredentialCache(str(tmpdir.join('credentials.json'))))
+    resolver.interactive = False
+
+    with pytest.raises(IOError):
+        resolver.session('my-aws')
+    assert not mock_input.called
+
+
+@mock.patch('ec2gazua.credential.boto3')
+def test_credential_resolver_static_keys_skip_sts(mock_boto3, tmpdir):
+    config = {
+        'my-aws': {
+            'credential': {
+                'aws_access_key_id': 'xxx1',
+                'aws_secret_access_key': 'xxx2',
+                'region': 'ap-northeast-2',
+            }
+        }
+    }
+    resolver = CredentialResolver(
+        config, CredentialCache(str(tmpdir.join('credentials.json'))))
+    resolver.resolve_all(['my-aws'])
+
+    assert not mock_boto3.Session.return_value.client.called
@@ -1,8 +1,20 @@
 # -*- coding: utf-8 -*-
 
+import botocore.session
+import mock
+
+from datetime import datetime
+from datetime import timezone
+
+from botocore.stub import Stubber
+
 from os.path import expanduser
 
+from ec2gazua.ec2 import ALL
 from ec2gazua.ec2 import EC2Instance
+from ec2gazua.ec2 import EC2InstanceLoader
+from ec2gazua.ec2 import EC2InstanceManager
+from ec2gazua.ec2 import group_dimensions
 
 
 def test_ec2_instance_tags():
@@ -211,3 +223,166 @@ def test_ec2_instance_override_nametag():
         }
     )
     assert instance.user == 'centos'
+
+
+def test_ec2_instance_loader_reload_rederives_without_request():
+    config = mock.MagicMock()
+    account = {
+        'name': 'my-aws',
+        'credential': {'aws_access_key_id': 'xxx',
+                       'aws_secret_access_key': 'xxx',
+                       'region': 'ap-northeast-2'},
+        'group-tag': 'Team',
+        'name-tag': 'Name',
+        'user': {'default': 'ec2-user'},
+    }
+    config.items.return_value = [('my-aws', account)]
+    config.__getitem__.side_effect = lambda name: account
+
+    loader = EC2InstanceLoader(config)
+    raw = {'InstanceId': 'i-1', 'Tags': [{'Key': 'Team', 'Value': 'ho'}]}
+    with mock.patch.object(loader, '_request_instances',
+                           return_value=[raw]) as request:
+        manager = loader.load_all()
+        assert manager.get_instances('my-aws', 'ho')[0].user == 'ec2-user'
+
+        account = dict(account, user={'default': 'centos'})
+        config.is_modified.return_value = True
+        config.reload.return_value = (set(), {'my-aws'}, set())
+
+        assert loader.reload(manager)
+        assert request.call_count == 1
+        assert manager.get_instances('my-aws', 'ho')[0].user == 'centos'
+
+        # the ui fetches in its executor, only the names are returned
+        config.reload.return_value = ({'my-aws'}, set(), set())
+        assert loader.reload_config(manager) == {'my-aws'}
+        assert request.call_count == 1
+        config.is_modified.return_value = False
+        assert loader.reload_config(manager) is None
+
+
+def test_ec2_instance_drops_raw():
+    raw = {
+        'InstanceId': 'i-1',
+        'State': {'Name': 'running'},
+        'LaunchTime': datetime(2024, 1, 1, tzinfo=timezone.utc),
+        'BlockDeviceMappings': [{'DeviceName': '/dev/xvda'}],
+    }
+    instance = EC2Instance({}, raw)
+    assert instance.raw is None
+    assert instance.is_running
+    assert instance.launch_time == 1704067200.0
+
+    assert EC2Instance({}, raw, keep_raw=True).raw is raw
+
+
+def test_ec2_instance_group_fallback_chain():
+    instance = EC2Instance(
+        {'group-tag': ['Service', 'aws:autoscaling:groupName']},
+        {'Tags': [{'Key': 'aws:autoscaling:groupName', 'Value': 'web-asg'}]})
+    assert instance.group == 'web-asg'
+
+
+def test_ec2_instance_manager_regroup():
+    config = {'name-tag': 'Name', 'group-tag': 'Team', 'pivot-tags': ['Env']}
+    instances = [
+        EC2Instance(config, {'InstanceId': 'i-%d' % n, 'Tags': [
+            {'Key': 'Team', 'Value': team}, {'Key': 'Env', 'Value': env},
+            {'Key': 'Owner', 'Value': 'me'}]})
+        for n, (team, env) in enumerate([('a', 'prod'), ('b', 'prod'),
+                                         ('a', 'dev')])]
+
+    manager = EC2InstanceManager()
+    manager.set_account('my-aws', instances, group_dimensions(config))
+    manager.sort()
+    assert manager.get_groups('my-aws') == ['a', 'b']
+    assert manager.get_dimensions() == [('Team',), ('Env',), ('Owner',)]
+
+    manager.regroup(('Env',))
+    assert manager.get_groups('my-aws') == ['dev', 'prod']
+    assert len(manager.get_instances('my-aws', 'prod')) == 2
+
+    manager.regroup(('Owner',))
+    assert manager.get_groups('my-aws') == ['me']
+
+    manager.regroup(None)
+    assert manager.get_groups('my-aws') == ['a', 'b']
+
+
+def test_ec2_instance_manager_merges_all_accounts():
+    config = {'name-tag': 'Name', 'group-tag': 'Team'}
+
+    def create(team, name):
+        return EC2Instance(config, {'InstanceId': name, 'Tags': [
+            {'Key': 'Team', 'Value': team}, {'Key': 'Name', 'Value': name}]})
+
+    manager = EC2InstanceManager()
+    manager.set_account('aws-1', [create('a', 'web-10'), create('b', 'db-1')],
+                        group_dimensions(config))
+    manager.set_account('aws-2', [create('a', 'web-2'), create('c', 'api')],
+                        group_dimensions(config))
+    manager.sort()
+
+    assert manager.get_groups(ALL) == [ALL, 'a', 'b', 'c']
+    assert [i.name for i in manager.get_instances(ALL, ALL)] == \
+        ['api', 'db-1', 'web-2', 'web-10']
+    assert [i.name for i in manager.get_instances(ALL, 'a')] == \
+        ['web-2', 'web-10']
+    assert [i.name for i in manager.search(ALL, ALL, 'WEB')] == \
+        ['web-2', 'web-10']
+
+    # only the changed account is sorted again
+    manager.set_account('aws-2', [create('d', 'cache')],
+                        group_dimensions(config))
+    manager.sort('aws-2')
+    assert list(manager.aws_names) == ['aws-1', 'aws-2']
+    assert manager.get_groups(ALL) == [ALL, 'a', 'b', 'd']
+
+    manager.remove_account('aws-2')
+    manager.sort()
+    assert manager.get_groups(ALL) == [ALL, 'a', 'b']
+
+
+def _status(instance_id, state):
+    return {'InstanceId': instance_id, 'InstanceState': {'Code': 0,
+                                                         'Name': state}}
+
+
+def test_ec2_instance_loader_polls_states():
+    client = botocore.session.get_session().create_client(
+        'ec2', region_name='ap-northeast-2', aws_access_key_id='xxx',
+        aws_secret_access_key='xxx')
+    stubber = Stubber(client)
+    loader = EC2InstanceLoader({'my-aws': {'name': 'my-aws'}})
+    loader.credentials.session = lambda aws_name: mock.Mock(
+        client=lambda *args, **kwargs: client)
+
+    stubber.add_response('describe_instances', {'Reservations': [{
+        'Instances': [{'InstanceId': 'i-1', 'State': {'Name': 'running'}},
+                      {'InstanceId': 'i-2', 'State': {'Name': 'stopped'}}]}]})
+    stubber.add_response('describe_instance_status', {'InstanceStatuses': [
+        _status('i-1', 'running'), _status('i-2', 'running')]})
+    stubber.add_response('describe_instances', {'Reservations': [{
+        'Instances': [{'InstanceId': 'i-2', 'PrivateIpAddress': '10.0.0.2',
+                       'PublicIpAddress': '1.2.3.4'}]}]},
+        {'InstanceIds': ['i-2']})
+    stubber.add_response('describe_instance_status', {'InstanceStatuses': [
+        _status('i-1', 'running'), _status('i-2', 'stopped')]})
+    stubber.add_response('describe_instance_status', {'InstanceStatuses': [
+        _status('i-1', 'running'), _status('i-3', 'pending')]})
+
+    with stubber:
+        loader.fetch('my-aws')
+        first, second = loader.instances['my-aws']
+
+        changed = loader.apply_states('my-aws', loader.poll_states('my-aws'))
+        assert changed == [second]
+        assert (second.state, second.public_ip) == ('running', '1.2.3.4')
+        assert (first.version, second.version) == (0, 1)
+
+        loader.apply_states('my-aws', loader.poll_states('my-aws'))
+        assert (second.state, second.public_ip) == ('stopped', None)
+
+        # a new instance needs a full fetch
+        assert loader.poll_states('my-aws') is None
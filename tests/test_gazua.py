@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import mock
+
+from ec2gazua.changes import Changes
+from ec2gazua.ec2 import ALL
+from ec2gazua.ec2 import EC2Instance
+from ec2gazua.ec2 import EC2InstanceLoader
+from ec2gazua.gazua import Gazua
+from ec2gazua.gazua import InstanceView
+from ec2gazua.history import History
+from ec2gazua.state import State
+
+CONFIG = {'name-tag': 'Name', 'group-tag': 'Env', 'key-file': {'default': ''}}
+
+
+def _create(name):
+    return EC2Instance(CONFIG, {'InstanceId': 'i-' + name,
+                                'InstanceType': 't3.micro',
+                                'Tags': [{'Key': 'Name', 'Value': name}]})
+
+
+@mock.patch('ec2gazua.ec2.EC2Instance.is_connectable', True)
+def test_instance_view_keeps_selection():
+    web = [_create('web-1'), _create('web-2')]
+    db = [_create('db-1')]
+
+    view = InstanceView(web)
+    view.rows['i-web-1'].set_state(True)
+    view.update_widgets(db)
+    view.select(db)
+    assert list(view.selected) == ['i-web-1', 'i-db-1']
+
+    view.update_widgets(web)
+    assert view.rows['i-web-1'].get_state()
+    view.invert(web)
+    assert list(view.selected) == ['i-db-1', 'i-web-2']
+    assert not view.rows['i-web-1'].get_state()
+    assert view.rows['i-web-2'].get_state()
+
+    view.clear()
+    assert not view.selected
+    assert not view.rows['i-web-2'].get_state()
+
+
+@mock.patch('ec2gazua.gazua.tmux')
+@mock.patch('ec2gazua.ec2.EC2Instance.is_connectable', True)
+def test_instance_view_connects_current_instances(mock_tmux):
+    web, db = _create('web-1'), _create('db-1')
+    reloaded = _create('web-1')
+    view = InstanceView([web, db], resolve=lambda ids: [
+        i for i in [reloaded] if i.id in ids])
+    view.select([web, db])
+
+    # db is gone and web was replaced by a reload since the selection
+    view._run_tmux()
+    mock_tmux.create_ssh_param.assert_called_once_with(reloaded)
+    assert list(view.selected) == ['i-web-1']
+
+
+@mock.patch('ec2gazua.gazua.tmux')
+@mock.patch('ec2gazua.ec2.EC2Instance.is_connectable',
+            property(lambda instance: instance.is_running))
+def test_instance_view_drops_stopped_selection(mock_tmux):
+    web, db = _create('web-1'), _create('db-1')
+    for instance in (web, db):
+        instance.state = 'running'
+    view = InstanceView([web, db], resolve=lambda ids: [
+        i for i in [web, db] if i.id in ids])
+    view.select([web, db])
+
+    # web stopped, the list was refreshed and db is not listed anymore
+    web.state = 'stopped'
+    web.touch()
+    view.update_widgets([web])
+    assert not view.rows['i-web-1'].get_state()
+    assert list(view.selected) == ['i-db-1']
+
+    db.state = 'stopped'
+    view._run_tmux()
+    assert not mock_tmux.create_ssh_param.called
+    assert not view.selected
+
+
+def test_lazy_start_focuses_an_account(tmpdir):
+    names = ('a-aws', 'b-aws', 'c-aws')
+    config = {name: dict(CONFIG, name=name) for name in names}
+    state = State(str(tmpdir.join('state.json')))
+    state.set('aws_name', ALL)
+    loader = EC2InstanceLoader(config, lazy=True)
+    raw = {'InstanceId': 'i-1', 'Tags': [{'Key': 'Name', 'Value': 'web'}]}
+
+    with mock.patch.object(loader, '_request_instances', return_value=[raw]):
+        gazua = Gazua(lazy=True, state=state, loader=loader,
+                      history=History(str(tmpdir.join('history'))),
+                      changes=Changes(str(tmpdir.join('changes'))))
+    # only the neighbour is prefetched, not every account of ALL
+    with mock.patch.object(gazua, 'request_load') as request_load:
+        gazua.attach(mock.Mock())
+
+    assert gazua.aws_view.get_selected_name() == 'a-aws'
+    assert [c[0][0] for c in request_load.call_args_list] == ['b-aws']
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+import mock
+import os
+
+from ec2gazua.ec2 import EC2Instance
+from ec2gazua.ec2 import EC2InstanceManager
+from ec2gazua.history import History
+
+CONFIG = {'name': 'my-aws', 'name-tag': 'Name', 'group-tag': 'Env'}
+DAY = 24 * 3600
+
+
+def _create(name, env):
+    return EC2Instance(CONFIG, {'InstanceId': 'i-' + name,
+                                'Tags': [{'Key': 'Name', 'Value': name},
+                                         {'Key': 'Env', 'Value': env}]})
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.time = 1000000000
+
+    def __call__(self):
+        return self.time
+
+
+def test_history_ranks_by_frecency(tmpdir):
+    path = str(tmpdir.join('ec2-gz', 'history.jsonl'))
+    web, db, cache = _create('web', 'prod'), _create('db', 'dev'), \
+        _create('cache', 'stage')
+    clock = Clock()
+
+    history = History(path, now=clock)
+    for _ in range(3):
+        history.record([db])
+    clock.time += 10 * DAY
+    history.record([web])
+
+    # one recent connection counts more than three old ones
+    history = History(path, now=clock)
+    assert history.rank_instances([cache, db, web]) == [web, db, cache]
+    connected = [(i.id, i.group) for i in (db, web)]
+    assert history.rank_groups(['dev', 'prod', 'stage'], connected) == \
+        ['prod', 'dev', 'stage']
+    assert history.rank_groups(['dev', 'prod'], []) == ['dev', 'prod']
+    # regrouped by another tag, the same connections rank its groups
+    connected = [(i.id, i.pivot(('Name',))) for i in (db, web)]
+    assert history.rank_groups(['cache', 'db', 'web'], connected) == \
+        ['web', 'db', 'cache']
+    assert oct(os.stat(path).st_mode & 0o777) == '0o600'
+
+
+def test_history_sessions(tmpdir):
+    path = tmpdir.join('history.jsonl')
+    web, db = _create('web', 'prod'), _create('db', 'prod')
+    clock = Clock()
+
+    history = History(str(path), now=clock)
+    history.record([web, db])
+    history.record([web])
+    clock.time += 7200
+    history.record([db, web])
+    # a line cut by a crash
+    path.write('[1,[["my-aws"', mode='a')
+
+    history = History(str(path), now=clock)
+    sessions = history.sessions()
+    assert [[h[2] for h in hosts] for _, hosts in sessions] == \
+        [['i-db', 'i-web'], ['i-web']]
+    assert history.labels(sessions) == ['1 now db,web', '2 2h web']
+
+    manager = EC2InstanceManager()
+    manager.set_account('my-aws', [web], [('Env',)])
+    # gone instances are skipped
+    assert manager.get_by_ids([h[2] for h in sessions[0][1]]) == [web]
+
+
+@mock.patch.object(History, 'MAX_LINES', 4)
+def test_history_compaction(tmpdir):
+    path = str(tmpdir.join('history.jsonl'))
+    history = History(path)
+    for i in range(5):
+        history.record([_create('web-%d' % i, 'prod')])
+
+    # the oldest half is dropped when the file is read again
+    assert [e[1][0][2] for e in History(path).entries] == \
+        ['i-web-3', 'i-web-4']
+    assert len(open(path).read().splitlines()) == 2
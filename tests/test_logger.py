@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import logging.handlers
+
+from ec2gazua.logger import log
+from ec2gazua.logger import set_level
+
+
+def test_logger_writes_through_queue():
+    assert any(isinstance(h, logging.handlers.QueueHandler)
+               for h in log.handlers)
+
+
+def test_logger_set_level():
+    logger = logging.getLogger('test_logger')
+
+    set_level(logger, 'debug')
+    assert logger.level == logging.DEBUG
+
+    set_level(logger, 'nonsense')
+    assert logger.level == logging.WARNING
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from ec2gazua.profiler import NULL_SPAN
+from ec2gazua.profiler import Profiler
+
+
+def test_profiler_disabled_records_nothing():
+    profiler = Profiler()
+
+    with profiler.span('config.load') as span:
+        pass
+
+    assert span is NULL_SPAN
+    assert list(profiler.iterate('page', [1, 2])) == [1, 2]
+    assert profiler.spans == []
+
+
+def test_profiler_summary_and_trace(tmpdir):
+    profiler = Profiler()
+    profiler.enable()
+
+    for _ in range(2):
+        with profiler.span('manager.sort'):
+            pass
+    assert list(profiler.iterate('page', [1, 2], aws_name='my-aws')) == [1, 2]
+
+    summary = profiler.summary()
+    assert summary['manager.sort'][0] == 2
+    assert summary['page'][0] == 2
+    assert 'manager.sort' in profiler.report()
+
+    path = str(tmpdir.join('trace.json'))
+    profiler.write_trace(path)
+    with open(path) as fp:
+        events = json.load(fp)['traceEvents']
+    assert len(events) == 4
+    assert events[-1]['args'] == {'aws_name': 'my-aws'}
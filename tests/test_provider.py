@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+import botocore.session
+import mock
+import pytest
+
+from botocore.stub import Stubber
+
+from ec2gazua.ec2 import ALL
+from ec2gazua.ec2 import EC2InstanceLoader
+
+ACCOUNT = {'group-tag': 'Team', 'name-tag': 'Name', 'ssh-path': '~/.ssh',
+           'user': {'default': 'ec2-user', 'group': {'ops': 'admin'}},
+           'key-file': {'default': 'id_rsa'},
+           'connect-ip': {'default': 'private'}}
+
+HOSTS = '''
+- name: bastion
+  ip: 10.0.0.1
+  tags:
+    Team: ops
+- id: legacy-db
+  ip: 10.0.0.2
+  state: stopped
+'''
+
+
+def test_file_and_ec2_providers(tmpdir):
+    path = tmpdir.join('hosts.yml')
+    path.write(HOSTS)
+    config = {
+        'my-aws': dict(ACCOUNT, name='my-aws'),
+        'static': dict(ACCOUNT, name='static', provider='file',
+                       path=str(path)),
+    }
+    client = botocore.session.get_session().create_client(
+        'ec2', region_name='ap-northeast-2', aws_access_key_id='xxx',
+        aws_secret_access_key='xxx')
+    stubber = Stubber(client)
+    stubber.add_response('describe_instances', {'Reservations': [{
+        'Instances': [{'InstanceId': 'i-1', 'State': {'Name': 'running'},
+                       'Tags': [{'Key': 'Team', 'Value': 'ops'}]}]}]})
+
+    loader = EC2InstanceLoader(config)
+    # only the aws accounts need credentials
+    loader.credentials.session = mock.Mock(return_value=mock.Mock(
+        client=lambda *args, **kwargs: client))
+    with stubber:
+        manager = loader.load_all()
+    assert {c[0] for c in loader.credentials.session.call_args_list} == \
+        {('my-aws',)}
+
+    bastion, = manager.get_instances('static', 'ops')
+    legacy, = manager.get_instances('static', 'UNKNOWN-GROUP')
+    assert [i.id for i in manager.get_instances(ALL, 'ops')] == \
+        ['bastion', 'i-1']
+    assert (bastion.name, bastion.user, bastion.connect_ip) == \
+        ('bastion', 'admin', '10.0.0.1')
+    assert (legacy.name, legacy.state) == ('legacy-db', 'stopped')
+    assert [i.id for _, i in manager.find('ip in 10.0.0.0/24')] == \
+        ['bastion', 'legacy-db']
+
+    # an edited file is fetched again
+    assert loader.poll_states('static') is not None
+    path.write(json.dumps([{'name': 'bastion'}]))
+    os.utime(str(path), (0, 0))
+    assert loader.poll_states('static') is None
+
+
+def test_json_file_provider(tmpdir):
+    path = tmpdir.join('hosts.json')
+    path.write(json.dumps({'instances': [{'name': 'web', 'type': 'vm'}]}))
+    loader = EC2InstanceLoader({'static': dict(
+        ACCOUNT, name='static', provider='file', path=str(path))})
+
+    manager = loader.load_all()
+    web, = manager.accounts['static']
+    assert (web.id, web.type, web.state) == ('web', 'vm', 'running')
+
+    path.write(json.dumps([{'ip': '10.0.0.1'}]))
+    with pytest.raises(ValueError):
+        loader.fetch('static')
+
+
+def test_unknown_provider():
+    loader = EC2InstanceLoader({'x': dict(ACCOUNT, name='x', provider='gcp')})
+    with pytest.raises(ValueError):
+        loader.load_all()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from ec2gazua.ec2 import EC2Instance
+from ec2gazua.ec2 import EC2InstanceManager
+from ec2gazua.ec2 import group_dimensions
+from ec2gazua.query import compile_query
+
+CONFIG = {'name-tag': 'Name', 'group-tag': 'Env',
+          'key-file': {'default': 'auto'}}
+
+
+def _create(name, state, type, ip, env, key='my-key'):
+    instance = {'InstanceId': 'i-' + name, 'InstanceType': type,
+                'State': {'Name': state}, 'PrivateIpAddress': ip,
+                'Tags': [{'Key': 'Name', 'Value': name},
+                         {'Key': 'Env', 'Value': env}]}
+    if key:
+        instance['KeyName'] = key
+    return EC2Instance(CONFIG, instance)
+
+
+def _manager():
+    manager = EC2InstanceManager()
+    manager.set_account('my-aws', [
+        _create('web-1', 'running', 'm5.large', '10.2.0.1', 'prod'),
+        _create('web-2', 'stopped', 'm5.xlarge', '10.2.1.1', 'prod'),
+        _create('db-1', 'running', 'r5.large', '10.3.0.1', 'prod', key=None),
+        _create('web-3', 'running', 'm5.large', '10.2.0.2', 'dev'),
+    ], group_dimensions(CONFIG))
+    manager.sort()
+    return manager
+
+
+def _names(manager, group, query):
+    return [i.name for i in manager.search('my-aws', group, query)]
+
+
+def test_query_terms():
+    manager = _manager()
+    assert _names(manager, 'prod', 'state=running') == ['db-1', 'web-1']
+    assert _names(manager, 'prod', 'type~m5.*') == ['web-1', 'web-2']
+    assert _names(manager, 'prod', 'type~xl') == ['web-2']
+    assert _names(manager, 'prod', 'ip in 10.2.0.0/16') == ['web-1', 'web-2']
+    assert _names(manager, 'prod', 'key:missing') == ['db-1']
+    assert _names(manager, 'prod', '!key:missing') == ['web-1', 'web-2']
+    assert _names(manager, 'prod', 'state!=running') == ['web-2']
+    assert _names(manager, 'dev', 'tag:Env=dev WEB') == ['web-3']
+    assert _names(manager, 'prod', 'state=running type~m5.* '
+                                   'tag:Env=prod ip in 10.2.0.0/16 '
+                                   '!key:missing') == ['web-1']
+
+
+def test_query_refines_cached_result():
+    manager = _manager()
+    manager.search('my-aws', 'prod', 'state=running')
+
+    # a refined query only reads the cached result, not the group
+    manager.instances['my-aws']['prod'] = []
+    assert _names(manager, 'prod', 'state=running web') == ['web-1']
+
+    manager.sort()
+    assert _names(manager, 'prod', 'state=running web') == ['web-1']
+
+
+def test_query_invalid():
+    with pytest.raises(ValueError):
+        compile_query('unknown=1')
+    with pytest.raises(ValueError):
+        compile_query('ip in 10.2.0.0/99')
+    with pytest.raises(ValueError):
+        compile_query('tag:Name="web')
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+import botocore.session
+import mock
+import pytest
+
+from botocore.exceptions import ClientError
+from botocore.exceptions import EndpointConnectionError
+from botocore.exceptions import ReadTimeoutError
+from botocore.stub import Stubber
+
+from ec2gazua.ec2 import EC2InstanceLoader
+from ec2gazua.scheduler import Scheduler
+
+CONFIG = {'name': 'my-aws', 'group-tag': 'Team', 'name-tag': 'Name'}
+
+PAGE = {'Reservations': [{'Instances': [{'InstanceId': 'i-1'}]}]}
+
+
+def _stubbed_loader():
+    client = botocore.session.get_session().create_client(
+        'ec2', region_name='ap-northeast-2', aws_access_key_id='xxx',
+        aws_secret_access_key='xxx')
+    stubber = Stubber(client)
+    loader = EC2InstanceLoader({'my-aws': CONFIG})
+    loader.credentials.session = lambda aws_name: mock.Mock(
+        client=lambda *args, **kwargs: client)
+    return loader, stubber
+
+
+def test_scheduler_retries_throttling():
+    scheduler = Scheduler(max_concurrency=4, sleep=lambda delay: None)
+    loader, stubber = _stubbed_loader()
+    stubber.add_client_error('describe_instances', 'RequestLimitExceeded',
+                             http_status_code=503)
+    stubber.add_client_error('describe_instances', 'RequestLimitExceeded',
+                             http_status_code=503)
+    stubber.add_response('describe_instances', PAGE)
+
+    with stubber, mock.patch('ec2gazua.ec2.scheduler', scheduler):
+        loader.fetch('my-aws')
+
+    assert [i.id for i in loader.instances['my-aws']] == ['i-1']
+    metric = scheduler.metrics['ec2.describe_instances']
+    assert (metric.calls, metric.retries, metric.throttled) == (3, 2, 2)
+    # halved twice, then grown by one success
+    assert scheduler.limit == pytest.approx(2)
+    assert 'throttled' in scheduler.status()
+
+
+def test_scheduler_raises_other_errors():
+    scheduler = Scheduler(sleep=lambda delay: None)
+    loader, stubber = _stubbed_loader()
+    stubber.add_client_error('describe_instances', 'UnauthorizedOperation')
+
+    with stubber, mock.patch('ec2gazua.ec2.scheduler', scheduler):
+        with pytest.raises(ClientError):
+            loader.fetch('my-aws')
+
+    metric = scheduler.metrics['ec2.describe_instances']
+    assert (metric.calls, metric.retries, metric.errors) == (1, 0, 1)
+
+
+def test_scheduler_retries_connection_errors():
+    scheduler = Scheduler(sleep=lambda delay: None)
+    func = mock.Mock(side_effect=[
+        EndpointConnectionError(endpoint_url='https://ec2'),
+        ReadTimeoutError(endpoint_url='https://ec2'), PAGE])
+
+    assert scheduler.call('ec2.describe_instances', func) == PAGE
+    metric = scheduler.metrics['ec2.describe_instances']
+    assert (metric.calls, metric.retries, metric.errors) == (3, 2, 0)
+    assert scheduler.limit == scheduler.max_concurrency
+
+
+def test_scheduler_caps_concurrency():
+    scheduler = Scheduler(max_concurrency=2)
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def call():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.pop()
+
+    threads = [threading.Thread(target=scheduler.call, args=('call', call))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max(peak) == 2
+    assert scheduler.metrics['call'].calls == 8
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+
+import pytest
+
+from datetime import datetime
+from datetime import timezone
+
+from ec2gazua import snapshot
+from ec2gazua.ec2 import EC2Instance
+from ec2gazua.snapshot import SnapshotLoader
+
+CONFIG = {
+    'name': 'my-aws',
+    'credential': {'aws_access_key_id': 'xxx1',
+                   'aws_secret_access_key': 'xxx2',
+                   'region': 'ap-northeast-2'},
+    'group-tag': 'Team',
+    'name-tag': 'Name',
+    'filter': {'connectable': False},
+    'user': {'default': 'ec2-user', 'group': {'ho': 'centos'}},
+}
+
+RAW = {
+    'InstanceId': 'i-1',
+    'InstanceType': 't2.micro',
+    'State': {'Name': 'running'},
+    'PrivateIpAddress': '10.0.0.1',
+    'KeyName': 'deploy',
+    'LaunchTime': datetime(2024, 1, 1, tzinfo=timezone.utc),
+    'Tags': [{'Key': 'Name', 'Value': 'web-1'},
+             {'Key': 'Team', 'Value': 'ho'}],
+}
+
+
+class MockLoader(object):
+
+    def __init__(self, count):
+        self.config = {'my-aws': CONFIG}
+        self.instances = {'my-aws': [EC2Instance(CONFIG, RAW)] * count}
+
+
+def test_snapshot_round_trip(tmpdir, monkeypatch):
+    monkeypatch.setattr(snapshot, 'CHUNK_SIZE', 2)
+    path = str(tmpdir.join('fleet.gz'))
+    snapshot.save(path, MockLoader(5))
+
+    loader = SnapshotLoader(path)
+    manager = loader.load_all()
+
+    instances = manager.get_instances('my-aws', 'ho')
+    assert len(instances) == 5
+    assert instances[0].to_record() == EC2Instance(CONFIG, RAW).to_record()
+    assert instances[0].user == 'centos'
+    assert 'credential' not in loader.config['my-aws']
+
+
+def test_snapshot_unsupported_version(tmpdir):
+    path = str(tmpdir.join('fleet.gz'))
+    with gzip.open(path, 'wt') as fp:
+        fp.write('{"format": "ec2-gz-snapshot", "version": 99}\n')
+
+    with pytest.raises(ValueError) as e:
+        SnapshotLoader(path)
+
+    assert 'Unsupported snapshot version 99' in str(e.value)
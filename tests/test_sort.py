@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from ec2gazua.ec2 import EC2Instance
+from ec2gazua.sort import natural_key
+from ec2gazua.sort import parse_order
+from ec2gazua.sort import sort_instances
+
+CONFIG = {'name-tag': 'Name'}
+
+
+def _instance(name, ip=None, launch=None, state='running'):
+    instance = EC2Instance(CONFIG, {
+        'InstanceId': name,
+        'InstanceType': 't2.micro',
+        'State': {'Name': state},
+        'PrivateIpAddress': ip,
+        'Tags': [{'Key': 'Name', 'Value': name}],
+    })
+    instance.launch_time = launch
+    instance.reset_sort_keys()
+    return instance
+
+
+def test_natural_key():
+    names = ['web-10', 'web-2', 'Web-1', 'api']
+    assert sorted(names, key=natural_key) == ['api', 'Web-1', 'web-2',
+                                              'web-10']
+
+
+def test_parse_order():
+    assert parse_order(None) == (('name', False),)
+    assert parse_order('ip') == (('ip', False),)
+    assert parse_order(['state', '-launch']) == (('state', False),
+                                                 ('launch', True))
+
+    with pytest.raises(ValueError):
+        parse_order('color')
+
+
+def test_sort_instances_by_ip_numerically():
+    instances = [_instance('a', '10.0.0.10'), _instance('b', '10.0.0.9'),
+                 _instance('c')]
+    sort_instances(instances, parse_order('ip'))
+    assert [i.name for i in instances] == ['b', 'a', 'c']
+
+
+def test_sort_instances_multi_key():
+    instances = [_instance('a', launch=1, state='stopped'),
+                 _instance('b', launch=1), _instance('c', launch=2)]
+    sort_instances(instances, parse_order(['state', '-launch']))
+    assert [i.name for i in instances] == ['c', 'b', 'a']
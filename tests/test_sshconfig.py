@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from ec2gazua.ec2 import EC2Instance
+from ec2gazua.ec2 import EC2InstanceManager
+from ec2gazua.sshconfig import SSHConfig
+
+
+def _config(tmpdir):
+    return {'name': 'my-aws', 'name-tag': 'Name', 'group-tag': 'Env',
+            'ssh-path': str(tmpdir), 'key-file': {'default': 'auto'},
+            'user': {'default': 'ec2-user', 'group': {'db': 'ubuntu'}},
+            'connect-ip': {'default': 'private'}}
+
+
+def _create(config, instance_id, name, env='web', state='running'):
+    return EC2Instance(config, {
+        'InstanceId': instance_id, 'KeyName': 'my-key',
+        'PrivateIpAddress': '10.0.0.%s' % instance_id[-1],
+        'State': {'Name': state},
+        'Tags': [{'Key': 'Name', 'Value': name},
+                 {'Key': 'Env', 'Value': env}]})
+
+
+def test_ssh_config_write(tmpdir):
+    tmpdir.join('my-key.pem').write('')
+    config = _config(tmpdir)
+    instances = [_create(config, 'i-1', 'web 1'),
+                 _create(config, 'i-5', 'api/1'),
+                 _create(config, 'i-6', 'api:1'),
+                 _create(config, 'i-2', 'db', 'db'),
+                 _create(config, 'i-3', 'db', 'db'),
+                 _create(config, 'i-4', 'old', state='stopped')]
+    manager = EC2InstanceManager()
+    manager.set_account('my-aws', instances, [('Env',)])
+
+    path = str(tmpdir.join('config.d', 'ec2-gz'))
+    ssh_config = SSHConfig(path)
+    # only kept up to date once it was written
+    assert not ssh_config.update(manager)
+    assert ssh_config.write(manager)
+
+    content = open(path).read()
+    assert 'Host web-1 i-1\n    HostName 10.0.0.1\n    User ec2-user\n' \
+           '    IdentityFile "%s"\n' % tmpdir.join('my-key.pem') in content
+    assert 'Host db.i-2 i-2\n    HostName 10.0.0.2\n    User ubuntu\n' \
+        in content
+    assert 'Host db.i-3 i-3\n' in content
+    # names sanitized to the same alias are duplicates too
+    assert 'Host api-1.i-5 i-5\n' in content
+    assert 'Host api-1.i-6 i-6\n' in content
+    assert 'i-4' not in content
+    assert oct(os.stat(path).st_mode & 0o777) == '0o600'
+
+    # the order of the lists does not matter
+    instances.reverse()
+    assert not SSHConfig(path).update(manager)
+    assert not ssh_config.update(manager)
+
+    instances[0].state = 'running'
+    instances[0].touch()
+    assert ssh_config.update(manager)
+    assert 'Host old i-4\n' in open(path).read()
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+
+from ec2gazua.state import State
+
+
+def test_state_save_and_restore(tmpdir):
+    path = str(tmpdir.join('ec2-gz', 'state.json'))
+    state = State(path)
+    state.set('aws_name', 'my-aws')
+    state.save()
+
+    assert State(path).get('aws_name') == 'my-aws'
+    assert State(path).get('group', 'UNKNOWN') == 'UNKNOWN'
+
+
+def test_state_broken_file(tmpdir):
+    path = tmpdir.join('state.json')
+    path.write('{broken')
+
+    assert State(str(path)).get('aws_name') is None